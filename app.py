@@ -1,9 +1,28 @@
 # -*- coding: utf-8 -*-
 import os
+import io
+import asyncio
+import json
+import queue
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+from urllib.parse import quote
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pads
+import pyarrow.parquet as pq
 from PIL import Image
 
 import streamlit as st
@@ -19,6 +38,10 @@ st.set_page_config(
     layout="wide",
 )
 
+# Copy-on-Write: los DataFrames que se entregan son vistas del snapshot compartido;
+# modificar una vista copia sólo la columna tocada y nunca altera el snapshot.
+pd.set_option("mode.copy_on_write", True)
+
 ASSETS_DIR = Path("assets")
 DATA_DIR = Path("data")
 ASSETS_DIR.mkdir(exist_ok=True, parents=True)
@@ -32,33 +55,1289 @@ F_RONDAS_PLT = DATA_DIR / "rondas_plantillas.csv"
 F_RONDAS_RUN = DATA_DIR / "rondas_ejecuciones.csv"
 F_INCIDENTES = DATA_DIR / "incidentes.csv"
 F_PTWOT      = DATA_DIR / "ptw_ot.csv"
+F_REGLAS     = DATA_DIR / "reglas_iot.csv"
+F_PATRONES   = DATA_DIR / "patrones_iot.csv"
+
+# Modo de almacenamiento:
+#   "csv"     -> cada escritura reescribe el archivo completo (comportamiento original)
+#   "journal" -> snapshot CSV + registro append-only (<tabla>.journal) con compactación en segundo plano
+#   "sqlite"  -> base SQLite en modo WAL (DATA_DIR/planta.db), una tabla por archivo F_*
+STORAGE_MODE = os.environ.get("APP_STORAGE", "csv").strip().lower()
+JOURNAL_COMPACT_BYTES = int(os.environ.get("APP_JOURNAL_COMPACT_KB", "512")) * 1024
+SQLITE_PATH = Path(os.environ.get("APP_SQLITE_PATH", str(DATA_DIR / "planta.db")))
+# APP_EAGER_LOAD=1 vuelve a cargar las siete tablas en cada rerun (para comparar latencias)
+EAGER_LOAD = os.environ.get("APP_EAGER_LOAD", "") == "1"
+# Ventana del escritor único: mutaciones que llegan dentro de este lapso van en el mismo commit
+GROUP_COMMIT_MS = float(os.environ.get("APP_GROUP_COMMIT_MS", "5"))
+# Zona horaria de planta para mostrar fechas (se guardan como epoch ms UTC); por defecto la del servidor
+def _system_tz():
+    """Zona del servidor por nombre (TZ, /etc/localtime, /etc/timezone), con sus cambios de hora; None si no se puede.
+
+    No se usa el offset fijo de datetime.now().astimezone(): con horario de verano
+    dejaría medio año de fechas corridas una hora.
+    """
+    nombres = [os.environ.get("TZ", "").lstrip(":")]
+    if os.name != "nt":
+        localtime = Path("/etc/localtime")
+        if not localtime.exists():
+            nombres.append("UTC")   # sin configuración, la hora local del sistema es UTC
+        elif "zoneinfo/" in os.path.realpath(localtime):
+            nombres.append(os.path.realpath(localtime).split("zoneinfo/", 1)[1])
+        if Path("/etc/timezone").exists():
+            nombres.append(Path("/etc/timezone").read_text().strip())
+    for nombre in filter(None, nombres):
+        try:
+            return ZoneInfo(nombre)
+        except (ValueError, ZoneInfoNotFoundError):
+            continue
+    return None
+
+APP_TZ = ZoneInfo(os.environ["APP_TZ"]) if os.environ.get("APP_TZ") else _system_tz()
+# Sin zona conocida (p. ej. Windows sin APP_TZ) se usa UTC y se avisa en la barra lateral.
+APP_TZ_SIN_DEFINIR = APP_TZ is None
+APP_TZ = APP_TZ or ZoneInfo("UTC")
+
+# Ingesta IoT: datagramas UDP con líneas "tag,variable,valor[,ts_ms]" (vacío = sin UDP),
+# archivo opcional con el mismo formato que se sigue como `tail -f`, y ventana de micro-lote.
+IOT_UDP = os.environ.get("APP_IOT_UDP", "127.0.0.1:9870").strip()
+IOT_TAIL = os.environ.get("APP_IOT_TAIL", "").strip()
+IOT_BATCH_MS = float(os.environ.get("APP_IOT_BATCH_MS", "200"))
+
+# Ejecuciones de rondas: "tabla" (mismo backend que el resto) o "parquet"
+# (DATA_DIR/rondas_ejecuciones/mes=YYYY-MM/plantilla=.../part-*.parquet)
+RONDAS_STORE = os.environ.get("APP_RONDAS_STORE", "tabla").strip().lower()
+RONDAS_PARQUET_DIR = DATA_DIR / "rondas_ejecuciones"
+RONDAS_PARTITION_MAX_FILES = 16
+
+# Clave primaria por tabla (necesaria para aplicar updates del journal)
+TABLE_KEYS = {
+    F_USUARIOS:   "user_id",
+    F_ACTIVOS:    "tag",
+    F_NOTIF:      "id",
+    F_RONDAS_PLT: None,
+    F_RONDAS_RUN: "id",
+    F_INCIDENTES: "id",
+    F_PTWOT:      "id",
+    F_REGLAS:     "id",
+    F_PATRONES:   "id",
+}
+
+# Tipos de columna en SQLite (el resto se guarda como TEXT)
+SQLITE_COLUMN_TYPES = {
+    "id": "INTEGER", "valor": "REAL", "en_rango": "INTEGER",
+    "lim_inf": "REAL", "lim_sup": "REAL",
+    "ts": "INTEGER", "ts_creacion": "INTEGER", "ts_recibida": "INTEGER", "ts_cerrada": "INTEGER",
+    "ts_solicitud": "INTEGER", "ts_cierre": "INTEGER", "limite": "REAL", "activa": "INTEGER",
+    "banda_muerta": "REAL", "retardo_on_s": "REAL", "retardo_off_s": "REAL", "ventana_s": "REAL",
+}
+# Columnas indexadas cuando existen en la tabla (además de la clave primaria)
+SQLITE_INDEXED = ("estado", "tag", "ts", "ts_creacion", "ts_solicitud")
+
+# Tipos en memoria por tabla (se aplican al cargar y al guardar). "text" es texto
+# libre en strings de Arrow (sin un objeto Python por celda); "epoch_ms" se guarda
+# como entero epoch en milisegundos y en memoria es datetime64[ms, UTC]. Las
+# columnas no listadas quedan como object.
+TABLE_SCHEMAS = {
+    F_USUARIOS:   {"rol": "category", "area": "category"},
+    F_ACTIVOS:    {"descripcion": "text", "area": "category"},
+    F_NOTIF:      {"id": "int32", "ts_creacion": "epoch_ms", "tag": "category", "titulo": "text",
+                   "motivo": "text", "prioridad": "category", "estado": "category",
+                   "asignado_a": "category", "ts_recibida": "epoch_ms", "ts_cerrada": "epoch_ms",
+                   "evidencia": "text"},
+    F_RONDAS_PLT: {"plantilla": "category", "tag": "category", "variable": "category",
+                   "lim_inf": "float32", "lim_sup": "float32"},
+    F_RONDAS_RUN: {"id": "int32", "ts": "epoch_ms", "plantilla": "category", "tag": "category",
+                   "variable": "category", "valor": "float32", "en_rango": "bool", "operario": "category"},
+    F_INCIDENTES: {"id": "int32", "ts": "epoch_ms", "tag": "category", "titulo": "text",
+                   "severidad": "category", "descripcion": "text", "reportado_por": "category",
+                   "estado": "category"},
+    F_PTWOT:      {"id": "int32", "ts_solicitud": "epoch_ms", "tipo": "category", "solicitante": "category",
+                   "area": "category", "estado": "category", "aprob_hse": "category",
+                   "ts_cierre": "epoch_ms", "adjuntos": "text"},
+    F_REGLAS:     {"id": "int32", "tag": "category", "variable": "category", "operador": "category",
+                   "comparador": "category",
+                   "limite": "float32", "prioridad": "category", "asignado_a": "category",
+                   "area": "category", "activa": "bool", "banda_muerta": "float32",
+                   "retardo_on_s": "float32", "retardo_off_s": "float32"},
+    F_PATRONES:   {"id": "int32", "nombre": "text", "pasos": "text", "ventana_s": "float32",
+                   "prioridad": "category", "asignado_a": "category", "area": "category", "activa": "bool"},
+}
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 # =========================
 # Utilidades y persistencia
 # =========================
-def now_iso() -> str:
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def now_ms() -> int:
+    """Instante actual como epoch UTC en milisegundos (formato de guardado de las fechas)."""
+    return time.time_ns() // 1_000_000
+
+def as_utc(value) -> pd.Timestamp:
+    """Fecha/hora suelta a Timestamp UTC; las fechas sin zona se interpretan en APP_TZ."""
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        return ts.tz_localize(APP_TZ, ambiguous=True, nonexistent="shift_forward").tz_convert("UTC")
+    return ts.tz_convert("UTC")
+
+def _local_to_utc(s: pd.Series) -> pd.Series:
+    """Fechas sin zona de APP_TZ a UTC sin perder ninguna en el cambio de hora: la hora
+    repetida se toma como la primera (horario de verano) y la inexistente se corre hacia adelante."""
+    return (s.dt.tz_localize(APP_TZ, ambiguous=np.ones(len(s), dtype=bool), nonexistent="shift_forward")
+             .dt.tz_convert("UTC").dt.as_unit("ms"))
 
-def _safe_read_csv(path: Path, dtypes=None, parse_dates=None) -> pd.DataFrame:
-    """Lectura segura de CSV (no rompe la app si hay corrupción)."""
+def ts_ms(s: pd.Series) -> np.ndarray:
+    """Columna epoch_ms como int64 (NaT = mínimo int64), para ordenar y comparar sin objetos."""
+    return s.dt.tz_convert(None).to_numpy("datetime64[ms]").view("int64")
+
+def to_local(s: pd.Series) -> pd.Series:
+    """Instantes (epoch ms, texto legado o datetime) en la zona de planta."""
+    return _coerce_column(s, "epoch_ms").dt.tz_convert(APP_TZ)
+
+def fmt_ms(ms: int) -> str:
+    """Epoch ms suelto como texto en la zona de planta."""
+    return pd.Timestamp(int(ms), unit="ms", tz="UTC").tz_convert(APP_TZ).strftime(TS_FORMAT)
+
+def _safe_read_csv(path: Path, dtypes=None, parse_dates=None, columns=None) -> pd.DataFrame:
+    """Lectura segura de CSV (no rompe la app si hay corrupción); con `columns` sólo parsea ésas."""
     if not path.exists():
         return pd.DataFrame()
+    usecols = None if columns is None else set(columns).__contains__
     try:
-        return pd.read_csv(path, dtype=dtypes, parse_dates=parse_dates, keep_default_na=False)
+        return pd.read_csv(path, dtype=dtypes, parse_dates=parse_dates, keep_default_na=False, usecols=usecols)
     except Exception as e:
         st.warning(f"Archivo dañado o no legible: {path.name}. Se carga vacío. Detalle: {e}")
         return pd.DataFrame()
 
-@st.cache_data(show_spinner=False)
-def load_csv(path: Path, dtypes=None, parse_dates=None) -> pd.DataFrame:
-    return _safe_read_csv(path, dtypes=dtypes, parse_dates=parse_dates)
+def _coerce_column(s: pd.Series, kind: str) -> pd.Series:
+    if kind == "category":
+        if isinstance(s.dtype, pd.CategoricalDtype) and not s.hasnans:
+            return s
+        if s.dtype == object and s.notna().all():
+            return s.astype("category")
+        return s.astype(object).where(s.notna(), "").astype(str).astype("category")
+    if kind == "text":
+        if s.dtype == "string[pyarrow]" and not s.hasnans:
+            return s
+        return s.astype("string[pyarrow]").fillna("")
+    if kind == "int32":
+        s = pd.to_numeric(s, errors="coerce")
+        return s.astype("Int32" if s.isna().any() else "int32")
+    if kind == "float32":
+        return pd.to_numeric(s, errors="coerce").astype("float32")
+    if kind == "bool":
+        if s.dtype == bool:
+            return s
+        return s.astype(str).str.lower().isin(["true", "1", "1.0"])
+    if kind == "epoch_ms":
+        if isinstance(s.dtype, pd.DatetimeTZDtype):
+            return s.dt.tz_convert("UTC").dt.as_unit("ms")
+        if pd.api.types.is_datetime64_dtype(s.dtype):
+            return _local_to_utc(s)
+        if s.dtype == object:
+            s = s.mask(s.eq(""))
+        num = pd.to_numeric(s, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        valid = ~np.isnan(num)
+        ms = np.where(valid, num, 0).astype("int64").astype("datetime64[ms]")
+        ms[~valid] = np.datetime64("NaT")
+        out = pd.Series(ms, index=s.index, name=s.name).dt.tz_localize("UTC").copy()
+        # Formato anterior: texto "%Y-%m-%d %H:%M:%S" en hora local.
+        legacy = pd.Series(~valid, index=s.index) & s.notna()
+        if legacy.any():
+            parsed = pd.to_datetime(s[legacy].astype(str), format="ISO8601", errors="coerce")
+            out[legacy] = _local_to_utc(parsed)
+        return out
+    return s
 
-def save_csv(df: pd.DataFrame, path: Path):
-    # Para evitar problemas de permisos, se guarda atómicamente cuando es posible.
+def apply_schema(df: pd.DataFrame, path: Path) -> pd.DataFrame:
+    """Tipos compactos de TABLE_SCHEMAS: categorías, texto Arrow, ids int32, lecturas float32, datetime64."""
+    schema = TABLE_SCHEMAS.get(path, {})
+    cols = {c: _coerce_column(df[c], kind) for c, kind in schema.items() if c in df.columns}
+    return df.assign(**cols) if cols else df
+
+def _storage_frame(df: pd.DataFrame, path: Path) -> pd.DataFrame:
+    """Forma de escritura: fechas como epoch ms (None si faltan) y categorías como texto."""
+    df = apply_schema(df, path)
+    cols = {}
+    for c, kind in TABLE_SCHEMAS.get(path, {}).items():
+        if c not in df.columns:
+            continue
+        if kind == "epoch_ms":
+            cols[c] = pd.Series(ts_ms(df[c]), index=df.index).astype(object).where(df[c].notna(), None)
+        elif kind == "category":
+            cols[c] = df[c].astype(object)
+    return df.assign(**cols) if cols else df
+
+def _coerce_value(path: Path, col: str, value):
+    """Valor de una mutación en el tipo de la columna en memoria."""
+    kind = TABLE_SCHEMAS.get(path, {}).get(col)
+    if kind == "epoch_ms":
+        if value in (None, ""):
+            return pd.NaT
+        if isinstance(value, (int, float, np.integer, np.floating)):
+            return pd.Timestamp(int(value), unit="ms", tz="UTC")
+        return as_utc(value)
+    return value
+
+def memory_report() -> pd.DataFrame:
+    """Memoria de cada tabla cargada como texto (object) vs. con su esquema compacto."""
+    rows = []
+    for path in TABLE_SCHEMAS:
+        raw = _read_table(path)
+        if not _is_parquet(path):
+            raw = raw.astype(object)
+        typed = apply_schema(raw, path)
+        antes = int(raw.memory_usage(deep=True).sum())
+        despues = int(typed.memory_usage(deep=True).sum())
+        rows.append({"tabla": path.stem, "filas": len(raw), "KB texto": round(antes / 1024, 1),
+                     "KB esquema": round(despues / 1024, 1),
+                     "reducción": f"{antes / despues:.1f}x" if despues else "-"})
+    return pd.DataFrame(rows)
+
+# =========================
+# Cache de tablas por versión
+# =========================
+# Cada tabla se cachea junto a su versión (stat del archivo, contador en SQLite y
+# un contador local que suben las escrituras). Una escritura sólo invalida su
+# propia tabla; el resto sigue sirviéndose desde memoria.
+# El snapshot de cada versión es inmutable y compartido por todas las sesiones: las
+# lecturas reciben vistas sin copia (Copy-on-Write) y el escritor único publica el
+# snapshot de la versión siguiente aplicando el lote en memoria, sin releer la tabla.
+@st.cache_resource(show_spinner=False)
+def _table_cache() -> dict:
+    return {"entries": {}, "local": {}, "stats": {}, "lock": threading.Lock()}
+
+def _stat_version(p: Path):
+    try:
+        st_ = p.stat()
+        return (st_.st_mtime_ns, st_.st_size)
+    except FileNotFoundError:
+        return None
+
+def table_version(path: Path) -> tuple:
+    """Versión actual de la tabla; cambia con cada escritura (propia o de otro proceso)."""
+    local = _table_cache()["local"].get(path, 0)
+    if _is_parquet(path):
+        return (local, _stat_version(RONDAS_PARQUET_DIR / "_version"))
+    if STORAGE_MODE == "sqlite":
+        return (local, _sqlite_version(path))
+    if STORAGE_MODE == "journal":
+        return (local, _stat_version(path), _stat_version(_journal_path(path)),
+                _stat_version(_compacting_path(path)))
+    return (local, _stat_version(path))
+
+def _bump_version(path: Path):
+    cache = _table_cache()
+    with cache["lock"]:
+        cache["local"][path] = cache["local"].get(path, 0) + 1
+
+def _read_table(path: Path, dtypes=None, parse_dates=None, columns=None) -> pd.DataFrame:
+    if _is_parquet(path):
+        return _parquet_read(columns=None if columns is None else [c for c in columns if c in RONDAS_COLUMNS])
+    return _read_backend(path, dtypes=dtypes, parse_dates=parse_dates, columns=columns)
+
+def _read_backend(path: Path, dtypes=None, parse_dates=None, columns=None) -> pd.DataFrame:
+    if STORAGE_MODE == "journal":
+        return _load_journaled(path, dtypes=dtypes, parse_dates=parse_dates, columns=columns)
+    if STORAGE_MODE == "sqlite":
+        return _sqlite_load(path, columns=columns)
+    return _safe_read_csv(path, dtypes=dtypes, parse_dates=parse_dates, columns=columns)
+
+def _cached_table(path: Path, dtypes=None, parse_dates=None) -> pd.DataFrame:
+    """DataFrame compartido del cache (no modificar: uso interno de sólo lectura)."""
+    cache = _table_cache()
+    # La versión se toma antes de leer: si alguien escribe durante la lectura,
+    # la próxima llamada ve una versión nueva y relee.
+    version = (table_version(path), repr(dtypes), repr(parse_dates))
+    stats = cache["stats"].setdefault(path.stem, {"hits": 0, "misses": 0})
+    entry = cache["entries"].get(path)
+    if entry is not None and entry[0] == version:
+        stats["hits"] += 1
+        return entry[1]
+    stats["misses"] += 1
+    df = apply_schema(_read_table(path, dtypes=dtypes, parse_dates=parse_dates), path)
+    cache["entries"][path] = (version, df)
+    return df
+
+def _cached_columns(path: Path, columns: tuple) -> pd.DataFrame:
+    """Sólo `columns` de la tabla: del snapshot completo si ya está cargado, si no leyendo sólo ésas."""
+    cache = _table_cache()
+    version = (table_version(path), repr(None), repr(None))
+    stats = cache["stats"].setdefault(path.stem, {"hits": 0, "misses": 0})
+    for entry in (cache["entries"].get(path), cache["entries"].get((path, columns))):
+        if entry is not None and entry[0] == version:
+            stats["hits"] += 1
+            return entry[1][[c for c in columns if c in entry[1].columns]]
+    stats["misses"] += 1
+    df = apply_schema(_read_table(path, columns=columns), path)
+    df = df[[c for c in columns if c in df.columns]]
+    cache["entries"][(path, columns)] = (version, df)
+    return df
+
+def _current_snapshot(path: Path, version):
+    """Snapshot cacheado si corresponde a `version` (lectura por defecto, sin dtypes)."""
+    entry = _table_cache()["entries"].get(path)
+    if entry is not None and entry[0] == (version, repr(None), repr(None)):
+        return entry[1]
+    return None
+
+def _publish_snapshot(path: Path, df: pd.DataFrame, version):
+    """Publica el snapshot de `version` (lo llama sólo el escritor, con la versión tomada al escribir)."""
+    cache = _table_cache()
+    with cache["lock"]:
+        cache["entries"][path] = ((version, repr(None), repr(None)), df)
+
+def load_csv(path: Path, dtypes=None, parse_dates=None, columns=None) -> pd.DataFrame:
+    """Vista de la tabla desde el cache (sin copia); con `columns` sólo se leen y cachean esas columnas."""
+    if columns is not None and dtypes is None and parse_dates is None:
+        return _cached_columns(path, tuple(columns)).copy(deep=False)
+    df = _cached_table(path, dtypes=dtypes, parse_dates=parse_dates)
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df.copy(deep=False)
+
+# Derivados que se guardan por tabla y tipo ("filter", "window", "latest", ...): cada
+# filtro o bloque distinto es una entrada, así que se conservan sólo los más usados.
+DERIVED_MAX_POR_TIPO = 32
+
+@st.cache_resource(show_spinner=False)
+def _derived_cache() -> dict:
+    return {"entries": OrderedDict(), "lock": threading.Lock()}   # orden = uso (LRU al principio)
+
+def derived(path: Path, name: str, build, version=None):
+    """Resultado derivado de una tabla (conteos, top-K, etc.), recalculado sólo cuando cambia su versión.
+
+    Para archivos que no son tablas F_* se puede pasar la versión explícita (p.ej. su stat).
+    Al guardar un resultado se descartan los de versiones anteriores de la misma tabla y,
+    por tipo, los menos usados por encima de DERIVED_MAX_POR_TIPO.
+    """
+    version = table_version(path) if version is None else version
+    cache = _derived_cache()
+    key = (path, name)
+    with cache["lock"]:
+        entry = cache["entries"].get(key)
+        if entry is not None and entry[0] == version:
+            cache["entries"].move_to_end(key)
+            return entry[1]
+    value = build()
+    tipo = name.split(":", 1)[0]
+    with cache["lock"]:
+        entries = cache["entries"]
+        entries[key] = (version, value)
+        entries.move_to_end(key)
+        viejos = [k for k, (v, _) in entries.items() if k[0] == path and v != version]
+        mismo_tipo = [k for k in entries if k[0] == path and k[1].split(":", 1)[0] == tipo and k not in viejos]
+        for k in viejos + mismo_tipo[:-DERIVED_MAX_POR_TIPO]:
+            del entries[k]
+    return value
+
+def _csv_tail(path: Path, k: int) -> pd.DataFrame:
+    """Últimas `k` filas de un CSV leyendo bloques desde el final (no parsea el resto)."""
+    with open(path, "rb") as fh:
+        header = fh.readline()
+        data_start = fh.tell()
+        fh.seek(0, os.SEEK_END)
+        pos = fh.tell()
+        buf = b""
+        while pos > data_start and buf.count(b"\n") <= k:
+            step = min(64 * 1024, pos - data_start)
+            pos -= step
+            fh.seek(pos)
+            buf = fh.read(step) + buf
+    lines = buf.splitlines(keepends=True)
+    if pos > data_start:
+        lines = lines[1:]  # la primera puede haber quedado cortada
+    return pd.read_csv(io.BytesIO(header + b"".join(lines[-k:])), keep_default_na=False)
+
+def read_latest(path: Path, k: int, sort_col: str) -> pd.DataFrame:
+    """Las `k` filas más nuevas según `sort_col`, sin cargar la tabla completa.
+
+    En CSV se lee la cola del archivo (las filas se agregan en orden de creación) y, si
+    no viene ordenada por `sort_col`, la tabla completa; en SQLite se usa el índice sobre `sort_col`.
+    """
+    def build():
+        if STORAGE_MODE == "sqlite":
+            if not _sqlite_has_table(path):
+                return pd.DataFrame()
+            state = _sqlite_state()
+            with state["lock"]:
+                return apply_schema(pd.read_sql_query(
+                    f'SELECT * FROM "{_sqlite_table(path)}" ORDER BY "{sort_col}" DESC, rowid DESC LIMIT ?',
+                    state["conn"], params=(k,)), path)
+        df = None
+        if STORAGE_MODE == "csv" and path.exists():
+            df = apply_schema(_csv_tail(path, k), path)
+            # Cola desordenada (fechas de origen, commits de otro proceso): no se puede asumir
+            # que sean las más nuevas.
+            if not df[sort_col].is_monotonic_increasing:
+                df = None
+        if df is None:
+            df = _cached_table(path)
+        if df.empty:
+            return df
+        # A igual timestamp, primero la fila agregada más tarde (como rowid DESC en SQLite).
+        return df.iloc[::-1].sort_values(sort_col, ascending=False, kind="stable").head(k)
+    return derived(path, f"latest:{sort_col}:{k}", build).copy(deep=False)
+
+def sort_order(path: Path, sort_col: str) -> np.ndarray:
+    """Posiciones de la tabla ordenadas por `sort_col` descendente (índice cacheado por versión)."""
+    def build():
+        df = _cached_table(path)
+        if df.empty:
+            return np.array([], dtype=np.int64)
+        col = df[sort_col]
+        vals = pd.Series(ts_ms(col) if isinstance(col.dtype, pd.DatetimeTZDtype) else col.to_numpy())
+        # A igual valor, primero la fila agregada más tarde.
+        return vals.iloc[::-1].sort_values(ascending=False, kind="stable").index.to_numpy()
+    return derived(path, f"order:{sort_col}", build)
+
+def sort_rank(path: Path, sort_col: str) -> np.ndarray:
+    """Inversa de sort_order: puesto de cada posición en el orden descendente."""
+    def build():
+        order = sort_order(path, sort_col)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        return rank
+    return derived(path, f"rank:{sort_col}", build)
+
+def _window_block(path: Path, sort_col: str, start: int, size: int) -> pd.DataFrame:
+    def build():
+        if STORAGE_MODE == "sqlite" and not _is_parquet(path):
+            if not _sqlite_has_table(path):
+                return pd.DataFrame()
+            state = _sqlite_state()
+            with state["lock"]:
+                return apply_schema(pd.read_sql_query(
+                    f'SELECT * FROM "{_sqlite_table(path)}" ORDER BY "{sort_col}" DESC, rowid DESC LIMIT ? OFFSET ?',
+                    state["conn"], params=(size, start)), path)
+        order = sort_order(path, sort_col)
+        return _cached_table(path).iloc[order[start:start + size]]
+    return derived(path, f"window:{sort_col}:{start}:{size}", build)
+
+def read_window(path: Path, sort_col: str, offset: int, limit: int) -> pd.DataFrame:
+    """Filas [offset, offset + limit) ordenadas por `sort_col` descendente.
+
+    Se materializan bloques de dos páginas alineados, así la página vecina ya
+    queda en cache cuando el usuario avanza.
+    """
+    size = 2 * limit
+    start = (offset // size) * size
+    block = _window_block(path, sort_col, start, size)
+    return block.iloc[offset - start: offset - start + limit].copy(deep=False)
+
+# =========================
+# Filtros de bandeja
+# =========================
+# Campos filtrables por tabla: dimensión lógica -> columna real.
+FILTER_FIELDS = {
+    "notificaciones": {"estado": "estado", "prioridad": "prioridad", "tag": "tag",
+                       "asignado_a": "asignado_a", "fecha": "ts_creacion",
+                       "texto": ("titulo", "motivo", "evidencia")},
+    "incidentes":     {"estado": "estado", "prioridad": "severidad", "tag": "tag",
+                       "asignado_a": "reportado_por", "fecha": "ts",
+                       "texto": ("titulo", "descripcion")},
+}
+
+def normalize_filter(filtro: dict) -> dict:
+    """Descarta criterios vacíos y ordena los valores, así filtros iguales comparten cache."""
+    out = {}
+    for k, v in (filtro or {}).items():
+        if v in (None, "", [], ()):
+            continue
+        out[k] = sorted(str(x) for x in v) if isinstance(v, (list, tuple, set)) else str(v)
+    return out
+
+def _codes_of(s: pd.Series) -> tuple:
+    """(códigos int, valores únicos como texto); las columnas categóricas ya traen sus códigos."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        codes = s.cat.codes.to_numpy()
+        uniques = pd.Index(s.cat.categories.astype(str))
+        if (codes < 0).any():
+            codes = np.where(codes < 0, len(uniques), codes)
+            uniques = uniques.append(pd.Index([""]))
+        return codes, uniques
+    codes, uniques = pd.factorize(s.astype(object).where(s.notna(), "").astype(str))
+    return codes, pd.Index(uniques)
+
+def _column_codes(path: Path, col: str) -> tuple:
+    """Columna codificada como categorías (códigos int + valores únicos), por versión."""
+    return derived(path, f"codes:{col}", lambda: _codes_of(_cached_table(path)[col]))
+
+def _column_ms(path: Path, col: str) -> np.ndarray:
+    return derived(path, f"ms:{col}", lambda: ts_ms(_coerce_column(_cached_table(path)[col], "epoch_ms")))
+
+def _column_text(path: Path, cols: tuple) -> pd.Series:
+    def build():
+        df = _cached_table(path)
+        txt = df[cols[0]].astype(object).fillna("").astype(str)
+        for c in cols[1:]:
+            txt = txt + " " + df[c].astype(object).fillna("").astype(str)
+        return txt.str.lower().reset_index(drop=True)
+    return derived(path, f"text:{','.join(cols)}", build)
+
+def compile_filter(path: Path, filtro: dict, skip=()) -> list:
+    """Traduce el filtro a predicados vectorizados; cada uno devuelve una máscara booleana.
+
+    Las dimensiones en `skip` (resueltas por un índice secundario) no generan predicado.
+    """
+    fields = FILTER_FIELDS[path.stem]
+    preds = []
+    for dim in ("estado", "prioridad", "tag", "asignado_a"):
+        if dim in filtro and dim not in skip:
+            def pred(col=fields[dim], values=filtro[dim]):
+                codes, uniques = _column_codes(path, col)
+                lut = np.zeros(len(uniques) + 1, dtype=bool)
+                idx = uniques.get_indexer(values)
+                lut[idx[idx >= 0]] = True
+                return lut[codes]
+            preds.append(pred)
+    if "desde" in filtro or "hasta" in filtro:
+        def pred(col=fields["fecha"], desde=filtro.get("desde"), hasta=filtro.get("hasta")):
+            # Comparación entera sobre epoch ms; los días se toman en la zona de planta.
+            ms = _column_ms(path, col)
+            mask = ms != np.iinfo(np.int64).min
+            if desde:
+                mask &= ms >= as_utc(desde).value // 1_000_000
+            if hasta:
+                mask &= ms < (as_utc(hasta) + pd.Timedelta(days=1)).value // 1_000_000
+            return mask
+        preds.append(pred)
+    if "texto" in filtro:
+        def pred(cols=fields["texto"], texto=filtro["texto"].lower()):
+            return _column_text(path, cols).str.contains(texto, regex=False).to_numpy()
+        preds.append(pred)
+    return preds
+
+def filter_positions(path: Path, filtro: dict, sort_col: str) -> np.ndarray:
+    """Posiciones que cumplen el filtro, ordenadas por `sort_col` descendente.
+
+    Cacheado por (filtro, versión de la tabla).
+    """
+    filtro = normalize_filter(filtro)
+    def build():
+        order = sort_order(path, sort_col)
+        if not filtro:
+            return order
+        # Candidatos desde los índices secundarios; el resto de los criterios se evalúa sólo sobre ellos.
+        fields = FILTER_FIELDS[path.stem]
+        cand, indexed = None, []
+        for dim in ("estado", "tag", "asignado_a"):
+            pos = index_positions(path, fields[dim], filtro[dim]) if dim in filtro else None
+            if pos is not None:
+                cand = pos if cand is None else np.intersect1d(cand, pos, assume_unique=True)
+                indexed.append(dim)
+        preds = compile_filter(path, filtro, skip=indexed)
+        if cand is None:
+            mask = np.ones(len(order), dtype=bool)
+            for pred in preds:
+                mask &= pred()
+            return order[mask[order]]
+        for pred in preds:
+            cand = cand[pred()[cand]]
+        return cand[np.argsort(sort_rank(path, sort_col)[cand], kind="stable")]
+    return derived(path, f"filter:{sort_col}:{json.dumps(filtro, sort_keys=True)}", build)
+
+def cache_stats() -> pd.DataFrame:
+    """Hits/misses del cache por tabla (para el mini-diagnóstico)."""
+    stats = _table_cache()["stats"]
+    rows = [{"tabla": t, **v} for t, v in sorted(stats.items())]
+    return pd.DataFrame(rows, columns=["tabla", "hits", "misses"])
+
+def _write_csv_atomic(df: pd.DataFrame, path: Path):
     tmp = path.with_suffix(path.suffix + ".tmp")
-    df.to_csv(tmp, index=False)
+    with open(tmp, "w", encoding="utf-8", newline="") as fh:
+        df.to_csv(fh, index=False)
+        fh.flush()
+        os.fsync(fh.fileno())
     tmp.replace(path)
 
+def save_csv(df: pd.DataFrame, path: Path):
+    # Para evitar problemas de permisos, se guarda atómicamente cuando es posible.
+    if _is_parquet(path):
+        _parquet_replace(df)
+    elif STORAGE_MODE == "journal":
+        # Reemplazo completo de la tabla: nuevo snapshot y se descarta el journal.
+        with _journal_state()["lock"], _table_lock(path):
+            _write_csv_atomic(_storage_frame(df, path), path)
+            _journal_path(path).unlink(missing_ok=True)
+            _compacting_path(path).unlink(missing_ok=True)
+    elif STORAGE_MODE == "sqlite":
+        _sqlite_replace(_storage_frame(df, path), path)
+    else:
+        # Con el mismo lock que el escritor, que toma la versión de su commit dentro de él.
+        with _table_lock(path):
+            _write_csv_atomic(_storage_frame(df, path), path)
+    _bump_version(path)
+    _kpi_replace(path, df)
+
+def table_exists(path: Path) -> bool:
+    if _is_parquet(path):
+        return (RONDAS_PARQUET_DIR / "_version").exists()
+    return _backend_has_table(path)
+
+def _backend_has_table(path: Path) -> bool:
+    if STORAGE_MODE == "sqlite":
+        return _sqlite_has_table(path)
+    return path.exists()
+
+def insert_rows(path: Path, rows: list) -> list:
+    """Inserta filas a través del escritor único y devuelve sus claves (ids asignados al commit)."""
+    return write_coordinator().submit(path, "insert", rows=[dict(r) for r in rows]).result(timeout=60)
+
+def update_row(path: Path, key_value, values: dict) -> bool:
+    """Actualiza columnas de la fila `key_value` sobre la versión vigente; False si no existe."""
+    return write_coordinator().submit(path, "update", key=key_value, values=dict(values)).result(timeout=60)
+
+def update_rows(path: Path, changes: list) -> list:
+    """Varios updates [(clave, valores)] enviados juntos: el escritor los aplica en el mismo commit."""
+    return write_rows(path, [], changes)[1]
+
+def write_rows(path: Path, rows: list, changes: list) -> tuple:
+    """Inserts y updates enviados juntos (un solo commit del escritor): (claves insertadas, updates encontrados)."""
+    muts = [{"op": "insert", "rows": [dict(r) for r in rows]}] if rows else []
+    muts += [{"op": "update", "key": k, "values": dict(v)} for k, v in changes]
+    results = [f.result(timeout=60) for f in write_coordinator().submit_many(path, muts)]
+    return (results.pop(0) if rows else []), results
+
+# =========================
+# Escritor único (group commit)
+# =========================
+# Todas las sesiones envían sus mutaciones a un hilo escritor por proceso. El hilo
+# junta lo que llega en GROUP_COMMIT_MS, aplica las mutaciones de cada tabla sobre
+# la versión vigente (no sobre la copia de la sesión) y hace un único commit con
+# fsync. Los updates son por columna, así que dos sesiones que tocan la misma
+# tabla ya no se pisan con su copia completa.
+class WriteCoordinator:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self.stats = {"commits": 0, "mutaciones": 0}
+        self._thread = threading.Thread(target=self._run, daemon=True, name="write-coordinator")
+        self._thread.start()
+
+    def submit(self, path: Path, op: str, **kwargs) -> Future:
+        fut = Future()
+        self._queue.put({"path": path, "op": op, "future": fut, **kwargs})
+        return fut
+
+    def submit_many(self, path: Path, muts: list) -> list:
+        """Varias mutaciones como una sola entrada de la cola, así nunca se reparten entre dos commits."""
+        futures = [Future() for _ in muts]
+        if muts:
+            self._queue.put({"path": path, "grupo": [{"path": path, "future": f, **m} for f, m in zip(futures, muts)]})
+        return futures
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + GROUP_COMMIT_MS / 1000
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch: list):
+        by_path = {}
+        for item in batch:
+            for m in item.get("grupo", [item]):
+                by_path.setdefault(m["path"], []).append(m)
+        for path, muts in by_path.items():
+            try:
+                results = _apply_mutations(path, muts)
+            except Exception as e:
+                for m in muts:
+                    m["future"].set_exception(e)
+                continue
+            self.stats["commits"] += 1
+            self.stats["mutaciones"] += len(muts)
+            for m, r in zip(muts, results):
+                m["future"].set_result(r)
+
+@st.cache_resource(show_spinner=False)
+def write_coordinator() -> WriteCoordinator:
+    return WriteCoordinator()
+
+def _assign_ids(path: Path, muts: list):
+    """Completa los ids faltantes de todos los inserts del lote con una sola reserva."""
+    if TABLE_KEYS.get(path) != "id":
+        return
+    pending = [r for m in muts if m["op"] == "insert" for r in m["rows"] if r.get("id") in (None, "")]
+    for new_id, row in zip(reserve_ids(path, len(pending)), pending):
+        row["id"] = new_id
+
+def _snapshot_apply(df: pd.DataFrame, path: Path, muts: list, index: dict) -> tuple:
+    """Aplica el lote sobre una vista del snapshot y devuelve (tabla nueva, resultados, exacto).
+
+    Los inserts se agregan al final y los updates sólo copian las columnas tocadas
+    (Copy-on-Write), así el snapshot original sigue intacto para los lectores.
+    `exacto` es False si un insert repite una clave existente: el journal lo aplica
+    como reemplazo y SQLite lo rechaza, así que ese resultado no se publica.
+    """
+    key = TABLE_KEYS.get(path)
+    df = df.copy(deep=False)
+    nuevos = {}   # clave -> posición de filas insertadas en este lote
+    results, exacto = [], True
+    for m in muts:
+        if m["op"] == "insert":
+            if key:
+                exacto &= not any(r.get(key) in index or r.get(key) in nuevos for r in m["rows"])
+            new_rows = apply_schema(pd.DataFrame(m["rows"]), path)
+            nuevos.update((r.get(key), len(df) + i) for i, r in enumerate(m["rows"]))
+            df = new_rows if df.empty and len(df.columns) == 0 else pd.concat([df, new_rows], ignore_index=True)
+            # concat degrada a object las columnas todas vacías o con categorías distintas.
+            df = apply_schema(df, path)
+            results.append([r.get(key) for r in m["rows"]])
+        else:
+            pos = nuevos.get(m["key"], index.get(m["key"]))
+            if pos is not None:
+                for col, val in m["values"].items():
+                    val = _coerce_value(path, col, val)
+                    if (col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype)
+                            and val not in df[col].cat.categories):
+                        df[col] = df[col].cat.add_categories([val])
+                    df.loc[df.index[pos], col] = val
+            results.append(pos is not None)
+    return df, results, exacto
+
+def _apply_mutations(path: Path, muts: list) -> list:
+    """Aplica un lote de mutaciones de una tabla en un único commit; devuelve un resultado por mutación."""
+    key = TABLE_KEYS.get(path)
+    _assign_ids(path, muts)
+    # Los deltas de los agregados se calculan contra la versión previa al commit.
+    version_prev = table_version(path)
+    kpi_delta = _kpi_delta(path, muts)
+    sec_prev = _sec_prepare(path, muts)
+    # Snapshot e índice de la versión previa, para publicar la siguiente sin releer.
+    published = None
+    snapshot = None if _is_parquet(path) else _current_snapshot(path, version_prev)
+    snap_index = pk_index(path) if snapshot is not None and key else {}
+    # Versión que deja este commit, tomada dentro del lock o la transacción de la escritura;
+    # None si otro proceso escribió después de version_prev (el snapshot y los índices
+    # de version_prev ya no sirven de base y se descartan).
+    version_new = None
+    if _is_parquet(path):
+        if any(m["op"] != "insert" for m in muts):
+            raise ValueError("Las ejecuciones de rondas en Parquet son append-only.")
+        _parquet_append(pd.DataFrame([r for m in muts for r in m["rows"]]))
+        _bump_version(path)
+        results = [[r.get(key) for r in m["rows"]] for m in muts]
+    elif STORAGE_MODE == "sqlite":
+        results, version_new = _sqlite_apply(path, muts, version_prev)
+    elif STORAGE_MODE == "journal":
+        index = pk_index(path) if key and any(m["op"] == "update" for m in muts) else {}
+        nuevos = set()
+        ops, results = [], []
+        for m in muts:
+            if m["op"] == "insert":
+                ops.extend({"op": "insert", "row": r} for r in m["rows"])
+                nuevos.update(r.get(key) for r in m["rows"])
+                results.append([r.get(key) for r in m["rows"]])
+            else:
+                found = m["key"] in index or m["key"] in nuevos
+                if found:
+                    ops.append({"op": "update", "key": m["key"], "set": m["values"]})
+                results.append(found)
+        if ops:
+            version_new = _append_journal(path, ops, version_prev)
+        else:
+            _bump_version(path)
+    else:
+        with _table_lock(path):
+            intacta = table_version(path) == version_prev
+            # La base se lee dentro del lock, así que lo publicado es siempre exacto.
+            index = pk_index(path) if key else {}
+            published, results, _ = _snapshot_apply(_cached_table(path), path, muts, index)
+            _write_csv_atomic(_storage_frame(published, path), path)
+            _bump_version(path)
+            version_pub = table_version(path)
+        _publish_snapshot(path, published, version_pub)
+        version_new = version_pub if intacta else None
+    if published is None and snapshot is not None and version_new is not None:
+        published, _, exacto = _snapshot_apply(snapshot, path, muts, snap_index)
+        if exacto:
+            _publish_snapshot(path, published, version_new)
+    _pk_commit(path, muts, version_prev, version_new)
+    _sec_commit(path, muts, version_prev, version_new, sec_prev)
+    _kpi_commit(path, muts, kpi_delta)
+    _rollup_commit(path, muts)
+    return results
+
+def _lookup_rows(path: Path, keys: list, cols: list) -> dict:
+    """Valores actuales de `cols` para las claves dadas: {clave: {col: valor}}."""
+    key = TABLE_KEYS[path]
+    if not keys:
+        return {}
+    if STORAGE_MODE == "sqlite" and not _is_parquet(path):
+        state = _sqlite_state()
+        names = ", ".join(f'"{c}"' for c in [key] + cols)
+        marks = ", ".join("?" for _ in keys)
+        with state["lock"]:
+            rows = state["conn"].execute(
+                f'SELECT {names} FROM "{_sqlite_table(path)}" WHERE "{key}" IN ({marks})',
+                [_sqlite_value(k) for k in keys]).fetchall()
+        return {r[0]: dict(zip(cols, r[1:])) for r in rows}
+    df = _cached_table(path)
+    if df.empty:
+        return {}
+    index = pk_index(path)
+    if index is None:
+        sub = df.loc[df[key].isin(keys), [key] + cols]
+    else:
+        sub = df.iloc[[index[k] for k in keys if k in index]][[key] + cols]
+    return {r[0]: dict(zip(cols, r[1:])) for r in sub.itertuples(index=False)}
+
+# =========================
+# Índice de clave primaria
+# =========================
+# clave -> posición de la fila en la tabla cacheada. Vive fuera del cache de
+# tablas: el escritor lo extiende en cada insert en vez de reconstruirlo, y sólo
+# se recalcula si la tabla cambió por otra vía (otro proceso, compactación).
+@st.cache_resource(show_spinner=False)
+def _pk_state() -> dict:
+    return {"lock": threading.Lock(), "tables": {}}
+
+def pk_index(path: Path):
+    """Índice {clave: posición} de la tabla, o None si la tabla no tiene clave o no es append-only."""
+    key = TABLE_KEYS.get(path)
+    if not key or _is_parquet(path):
+        return None
+    state = _pk_state()
+    version = table_version(path)
+    with state["lock"]:
+        entry = state["tables"].get(path)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+    df = _cached_table(path)
+    index = dict(zip(df[key].tolist(), range(len(df)))) if key in df.columns else {}
+    with state["lock"]:
+        state["tables"][path] = (version, index, len(df))
+    return index
+
+def _pk_commit(path: Path, muts: list, version_prev, version_new):
+    """Extiende el índice con las filas insertadas (se agregan al final de la tabla).
+
+    `version_new` es la versión del commit (None si otro proceso escribió en el medio:
+    el índice se descarta y se reconstruye en la próxima lectura).
+    """
+    key = TABLE_KEYS.get(path)
+    if not key or _is_parquet(path):
+        return
+    state = _pk_state()
+    with state["lock"]:
+        entry = state["tables"].pop(path, None)
+        if entry is None or entry[0] != version_prev or version_new is None:
+            return
+        index, n = entry[1], entry[2]
+        for m in muts:
+            if m["op"] != "insert":
+                continue
+            for r in m["rows"]:
+                k = r.get(key)
+                if k in index:
+                    # Un insert sobre una clave existente no agrega fila: se reconstruye.
+                    return
+                index[k] = n
+                n += 1
+        state["tables"][path] = (version_new, index, n)
+
+def get_row(path: Path, key_value):
+    """Fila con esa clave como dict (None si no existe); O(1) vía el índice de clave primaria.
+
+    En SQLite se consulta por el índice único de la tabla, sin cargarla.
+    """
+    index = None if STORAGE_MODE == "sqlite" else pk_index(path)
+    if index is None:
+        if STORAGE_MODE == "sqlite" and not _is_parquet(path):
+            with _sqlite_state()["lock"]:
+                cols = _sqlite_columns(_sqlite_state()["conn"], path)
+            cols = [c for c in cols if c != TABLE_KEYS[path]]
+        else:
+            cols = [c for c in _cached_table(path).columns if c != TABLE_KEYS[path]]
+        row = _lookup_rows(path, [key_value], cols).get(key_value)
+        return None if row is None else {TABLE_KEYS[path]: key_value, **row}
+    df = _cached_table(path)
+    pos = index.get(key_value)
+    if pos is None or pos >= len(df):
+        return None
+    return df.iloc[pos].to_dict()
+
+# =========================
+# Índices secundarios
+# =========================
+# valor -> posiciones ordenadas (np.ndarray) para las dimensiones más consultadas.
+# Igual que el índice de clave primaria, se construye una vez por proceso y el
+# escritor lo mantiene en cada commit; los arrays se reemplazan, nunca se
+# modifican, así una lectura en curso no ve un índice a medio actualizar.
+SECONDARY_INDEXES = {
+    "notificaciones":     ("tag", "asignado_a", "estado"),
+    "incidentes":         ("tag", "reportado_por", "estado"),
+    "rondas_ejecuciones": ("tag", "operario"),
+}
+
+@st.cache_resource(show_spinner=False)
+def _sec_state() -> dict:
+    return {"lock": threading.Lock(), "tables": {}}
+
+def _sec_value(v) -> str:
+    return "" if v is None or (isinstance(v, float) and np.isnan(v)) else str(v)
+
+def _sec_build(df: pd.DataFrame, cols) -> dict:
+    out = {}
+    for col in cols:
+        if col not in df.columns:
+            continue
+        codes, uniques = _codes_of(df[col])
+        order = np.argsort(codes, kind="stable")
+        bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+        out[col] = dict(zip(uniques, np.split(order, bounds)))
+    return out
+
+def _sec_lookup(col_index: dict, values) -> np.ndarray:
+    parts = [col_index[v] for v in map(_sec_value, values) if v in col_index]
+    if not parts:
+        return np.array([], dtype=np.int64)
+    return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts), kind="stable")
+
+def secondary_index(path: Path):
+    """{columna: {valor: posiciones}} de la tabla, o None si no tiene índices secundarios."""
+    cols = SECONDARY_INDEXES.get(path.stem)
+    if not cols or _is_parquet(path):
+        return None
+    state = _sec_state()
+    version = table_version(path)
+    with state["lock"]:
+        entry = state["tables"].get(path)
+        if entry is not None and entry[0] == version:
+            return entry[2]
+    df = _cached_table(path)
+    index = _sec_build(df, cols)
+    with state["lock"]:
+        state["tables"][path] = (version, len(df), index)
+    return index
+
+def index_positions(path: Path, col: str, values):
+    """Posiciones (ordenadas) de las filas con `col` en `values`; None si la columna no está indexada."""
+    index = secondary_index(path)
+    if index is None or col not in index:
+        return None
+    return _sec_lookup(index[col], values)
+
+def _sec_prepare(path: Path, muts: list) -> dict:
+    """Antes del commit: posición y valores indexados vigentes de las filas que se actualizan."""
+    cols = SECONDARY_INDEXES.get(path.stem, ())
+    state = _sec_state()
+    with state["lock"]:
+        entry = state["tables"].get(path)
+    keys = [m["key"] for m in muts if m["op"] == "update" and set(m["values"]) & set(cols)]
+    if entry is None or not keys:
+        return {}
+    index, df = pk_index(path), _cached_table(path)
+    prev = {}
+    for k in keys:
+        pos = index.get(k) if index is not None else None
+        if pos is not None and pos < len(df):
+            prev[k] = (pos, {c: _sec_value(df.iloc[pos][c]) for c in cols if c in df.columns})
+    return prev
+
+def _sec_commit(path: Path, muts: list, version_prev, version_new, prev: dict):
+    """Aplica el lote sobre el índice: inserts al final, updates mueven la posición de valor."""
+    cols = SECONDARY_INDEXES.get(path.stem, ())
+    key = TABLE_KEYS.get(path)
+    if not cols or _is_parquet(path):
+        return
+    state = _sec_state()
+    with state["lock"]:
+        entry = state["tables"].pop(path, None)
+        if entry is None or entry[0] != version_prev or version_new is None:
+            return
+        n, index = entry[1], {c: dict(v) for c, v in entry[2].items()}
+        # Por clave: posición, valores antes del lote (None si se insertó en él) y valores finales.
+        touched = {}
+        for m in muts:
+            if m["op"] == "insert":
+                for r in m["rows"]:
+                    touched[r.get(key)] = (n, None, {c: _sec_value(r.get(c)) for c in index})
+                    n += 1
+            else:
+                k = m["key"]
+                if k not in touched:
+                    if k not in prev:
+                        continue
+                    touched[k] = (prev[k][0], prev[k][1], prev[k][1])
+                pos, antes, vals = touched[k]
+                vals = {**vals, **{c: _sec_value(v) for c, v in m["values"].items() if c in index}}
+                touched[k] = (pos, antes, vals)
+        adds, removes = {}, {}
+        for pos, antes, vals in touched.values():
+            for c, v in vals.items():
+                if antes is None or antes.get(c) != v:
+                    adds.setdefault((c, v), []).append(pos)
+                    if antes is not None:
+                        removes.setdefault((c, antes.get(c)), []).append(pos)
+        for (c, v) in set(adds) | set(removes):
+            arr = index[c].get(v, np.array([], dtype=np.int64))
+            if (c, v) in removes:
+                arr = arr[~np.isin(arr, removes[(c, v)])]
+            if (c, v) in adds:
+                arr = np.unique(np.concatenate([arr, np.asarray(adds[(c, v)], dtype=np.int64)]))
+            index[c][v] = arr
+        state["tables"][path] = (version_new, n, index)
+
+def bench_secondary_index(sizes=(10_000, 100_000, 1_000_000), reps: int = 200) -> pd.DataFrame:
+    """Latencia de "todo lo del tag X" (100 filas) con índice vs. máscara booleana, según tamaño."""
+    rng = np.random.default_rng(0)
+    rows = []
+    for n in sizes:
+        tags = rng.choice(["V-210", "P-101", "TK-1203", "K-301"], n).astype(object)
+        tags[rng.choice(n, 100, replace=False)] = "X-900"
+        df = pd.DataFrame({"tag": tags})
+        index = _sec_build(df, ["tag"])["tag"]
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            _sec_lookup(index, ["X-900"])
+        idx_us = (time.perf_counter() - t0) / reps * 1e6
+        col = df["tag"]
+        t0 = time.perf_counter()
+        for _ in range(reps // 10 or 1):
+            np.flatnonzero((col == "X-900").to_numpy())
+        mask_us = (time.perf_counter() - t0) / (reps // 10 or 1) * 1e6
+        rows.append({"filas": n, "µs índice": round(idx_us, 1), "µs máscara": round(mask_us, 1)})
+    return pd.DataFrame(rows)
+
+# =========================
+# Rollup diario de rondas
+# =========================
+# Lecturas y lecturas en rango por (fecha, plantilla, tag, variable), sumadas por
+# el escritor en cada "Guardar ronda". La tendencia del Dashboard se arma desde
+# acá sin leer las ejecuciones crudas.
+F_RONDAS_ROLLUP = DATA_DIR / "rondas_rollup_diario.csv"
+ROLLUP_KEYS = ["fecha", "plantilla", "tag", "variable"]
+ROLLUP_COLUMNS = ROLLUP_KEYS + ["lecturas", "en_rango"]
+
+def _rollup_of(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    out = (
+        df.assign(fecha=to_local(df["ts"]).dt.strftime("%Y-%m-%d"),
+                  en_rango=df["en_rango"].astype(str).isin(["True", "true", "1"]).astype(int))
+          .groupby(ROLLUP_KEYS, observed=True)
+          .agg(lecturas=("en_rango", "size"), en_rango=("en_rango", "sum"))
+          .reset_index()
+    )
+    return out[ROLLUP_COLUMNS]
+
+def _rollup_save(df: pd.DataFrame):
+    _write_csv_atomic(df.sort_values(ROLLUP_KEYS), F_RONDAS_ROLLUP)
+
+def rebuild_rondas_rollup() -> pd.DataFrame:
+    df = _rollup_of(read_rondas_run(columns=["ts", "plantilla", "tag", "variable", "en_rango"]))
+    _rollup_save(df)
+    return df
+
+def rondas_rollup() -> pd.DataFrame:
+    """Rollup diario (se reconstruye desde las ejecuciones si todavía no existe)."""
+    if not F_RONDAS_ROLLUP.exists():
+        rebuild_rondas_rollup()
+    def build():
+        return pd.read_csv(F_RONDAS_ROLLUP, keep_default_na=False)
+    return derived(F_RONDAS_ROLLUP, "rollup", build, version=_stat_version(F_RONDAS_ROLLUP))
+
+def _rollup_commit(path: Path, muts: list):
+    if path != F_RONDAS_RUN:
+        return
+    rows = [r for m in muts if m["op"] == "insert" for r in m["rows"]]
+    if not rows:
+        return
+    if not F_RONDAS_ROLLUP.exists():
+        # Primera ronda: se arma desde las ejecuciones, que ya incluyen este commit.
+        rebuild_rondas_rollup()
+        return
+    delta = _rollup_of(pd.DataFrame(rows))
+    merged = pd.concat([rondas_rollup(), delta], ignore_index=True)
+    _rollup_save(merged.groupby(ROLLUP_KEYS, as_index=False)[["lecturas", "en_rango"]].sum())
+
+def check_rondas_rollup(fix: bool = True) -> pd.DataFrame:
+    """Diferencias entre el rollup guardado y un recálculo desde las ejecuciones."""
+    real = _rollup_of(read_rondas_run(columns=["ts", "plantilla", "tag", "variable", "en_rango"]))
+    saved = rondas_rollup()
+    cmp = saved.merge(real, on=ROLLUP_KEYS, how="outer", suffixes=("_guardado", "_real")).fillna(0)
+    diff = cmp[(cmp["lecturas_guardado"] != cmp["lecturas_real"]) | (cmp["en_rango_guardado"] != cmp["en_rango_real"])]
+    if fix and not diff.empty:
+        _rollup_save(real)
+    return diff.reset_index(drop=True)
+
+# =========================
+# KPIs materializados
+# =========================
+# Contadores de notificaciones por (estado, prioridad, tag, área) y cantidad de
+# filas por tabla, mantenidos por el escritor en cada commit y persistidos en
+# DATA_DIR/kpis.json. Inicio y Dashboard los leen sin recorrer las tablas.
+# check_kpis() los recalcula desde cero y corrige cualquier desvío (p.ej. si
+# otro proceso escribió sin pasar por este escritor).
+F_KPIS = DATA_DIR / "kpis.json"
+KPI_DIMS = ["estado", "prioridad", "tag"]
+
+@st.cache_resource(show_spinner=False)
+def _kpi_state() -> dict:
+    return {"mtime": None, "counts": {}, "filas": {}, "lock": threading.Lock()}
+
+def _tag_areas() -> dict:
+    return derived(F_ACTIVOS, "tag->area", lambda: dict(zip(_cached_table(F_ACTIVOS)["tag"],
+                                                           _cached_table(F_ACTIVOS)["area"])))
+
+def _kpi_key(row: dict, areas: dict) -> tuple:
+    return (str(row.get("estado", "")), str(row.get("prioridad", "")), str(row.get("tag", "")),
+            areas.get(row.get("tag"), ""))
+
+def _kpi_counts_of(df: pd.DataFrame) -> dict:
+    counts = {}
+    if not df.empty:
+        areas = _tag_areas()
+        g = df.groupby(KPI_DIMS, sort=False, observed=True).size()
+        for (estado, prioridad, tag), n in g.items():
+            k = _kpi_key({"estado": estado, "prioridad": prioridad, "tag": tag}, areas)
+            counts[k] = counts.get(k, 0) + int(n)
+    return counts
+
+def _kpi_rebuild() -> tuple:
+    filas = {path.stem: len(_cached_table(path)) for path in TABLE_KEYS}
+    return _kpi_counts_of(_cached_table(F_NOTIF)), filas
+
+def _kpi_lock():
+    """Lock entre procesos de kpis.json: cada proceso lo relee, aplica su delta y lo reescribe."""
+    return _file_lock(DATA_DIR / "_locks" / "kpis.lock")
+
+def _kpi_save(state: dict):
+    payload = {"notificaciones": [list(k) + [n] for k, n in state["counts"].items() if n],
+               "filas": state["filas"]}
+    tmp = F_KPIS.with_suffix(".tmp")
+    tmp.write_text(json.dumps(payload, ensure_ascii=False))
+    tmp.replace(F_KPIS)
+    state["mtime"] = _stat_version(F_KPIS)
+
+def _kpi_refresh(state: dict) -> bool:
+    """Pone el estado al día con kpis.json (con el lock tomado); True si hubo que recalcularlo de las tablas."""
+    current = _stat_version(F_KPIS)
+    if current is None:
+        state["counts"], state["filas"] = _kpi_rebuild()
+        _kpi_save(state)
+        return True
+    if current != state["mtime"]:
+        payload = json.loads(F_KPIS.read_text())
+        state["counts"] = {tuple(r[:4]): int(r[4]) for r in payload.get("notificaciones", [])}
+        state["filas"] = {k: int(v) for k, v in payload.get("filas", {}).items()}
+        state["mtime"] = current
+    return False
+
+def _kpi_load() -> dict:
+    """Estado de los contadores; se relee si otro proceso actualizó kpis.json."""
+    state = _kpi_state()
+    with state["lock"], _kpi_lock():
+        _kpi_refresh(state)
+    return state
+
+def _kpi_delta(path: Path, muts: list) -> dict:
+    if path != F_NOTIF:
+        return {}
+    areas = _tag_areas()
+    updates = [m for m in muts if m["op"] == "update" and set(m["values"]) & set(KPI_DIMS)]
+    current = _lookup_rows(path, [m["key"] for m in updates], KPI_DIMS)
+    delta = {}
+    for m in muts:
+        if m["op"] == "insert":
+            for r in m["rows"]:
+                k = _kpi_key(r, areas)
+                delta[k] = delta.get(k, 0) + 1
+                current[r.get("id")] = {c: r.get(c, "") for c in KPI_DIMS}
+        elif m in updates and m["key"] in current:
+            old = current[m["key"]]
+            new = {**old, **{c: v for c, v in m["values"].items() if c in KPI_DIMS}}
+            delta[_kpi_key(old, areas)] = delta.get(_kpi_key(old, areas), 0) - 1
+            delta[_kpi_key(new, areas)] = delta.get(_kpi_key(new, areas), 0) + 1
+            current[m["key"]] = new
+    return delta
+
+def _kpi_commit(path: Path, muts: list, delta: dict):
+    inserted = sum(len(m["rows"]) for m in muts if m["op"] == "insert")
+    if not delta and not inserted:
+        return
+    state = _kpi_state()
+    with state["lock"], _kpi_lock():
+        # Recién recalculados desde las tablas, que ya incluyen este commit: el delta sobra.
+        if _kpi_refresh(state):
+            return
+        for k, n in delta.items():
+            state["counts"][k] = state["counts"].get(k, 0) + n
+        state["filas"][path.stem] = state["filas"].get(path.stem, 0) + inserted
+        _kpi_save(state)
+
+def _kpi_replace(path: Path, df: pd.DataFrame):
+    """Reemplazo completo de una tabla (save_csv): ajusta sólo sus contadores, sin releer las demás."""
+    if path not in TABLE_KEYS or _stat_version(F_KPIS) is None:
+        return   # sin kpis.json se recalculan completos en la próxima lectura
+    state = _kpi_state()
+    with state["lock"], _kpi_lock():
+        if _kpi_refresh(state):
+            return
+        state["filas"][path.stem] = len(df)
+        # Las notificaciones cambian los conteos y los activos el área de cada tag.
+        if path == F_NOTIF:
+            state["counts"] = _kpi_counts_of(apply_schema(df, path))
+        elif path == F_ACTIVOS:
+            state["counts"] = _kpi_counts_of(_cached_table(F_NOTIF))
+        _kpi_save(state)
+
+def kpi_counts(by: str) -> dict:
+    """Totales de notificaciones agrupados por "estado", "prioridad", "tag" o "area"."""
+    pos = {"estado": 0, "prioridad": 1, "tag": 2, "area": 3}[by]
+    out = {}
+    for k, n in _kpi_load()["counts"].items():
+        if n:
+            out[k[pos]] = out.get(k[pos], 0) + n
+    return out
+
+def table_rows(path: Path) -> int:
+    """Cantidad de filas de la tabla según los contadores materializados."""
+    return _kpi_load()["filas"].get(path.stem, 0)
+
+def mean_close_time():
+    """Promedio de ts_cerrada − ts_creacion de las notificaciones cerradas (Timedelta, o None)."""
+    def build():
+        if STORAGE_MODE == "sqlite":
+            if not _sqlite_has_table(F_NOTIF):
+                return None
+            state = _sqlite_state()
+            with state["lock"]:
+                ms = state["conn"].execute(
+                    f'SELECT AVG(ts_cerrada - ts_creacion) FROM "{_sqlite_table(F_NOTIF)}" '
+                    "WHERE typeof(ts_cerrada) = 'integer' AND typeof(ts_creacion) = 'integer'").fetchone()[0]
+            return None if ms is None else pd.Timedelta(milliseconds=ms)
+        df = _cached_table(F_NOTIF)
+        if "ts_cerrada" not in df.columns:
+            return None
+        dur = (df["ts_cerrada"] - df["ts_creacion"]).dropna()
+        return dur.mean() if not dur.empty else None
+    return derived(F_NOTIF, "cierre_medio", build)
+
+def check_kpis(fix: bool = True) -> pd.DataFrame:
+    """Compara los contadores con un recálculo completo; con `fix` reemplaza los guardados."""
+    state = _kpi_load()
+    counts, filas = _kpi_rebuild()
+    rows = []
+    for k in sorted(set(counts) | {k for k, n in state["counts"].items() if n}):
+        if counts.get(k, 0) != state["counts"].get(k, 0):
+            rows.append({"clave": " / ".join(k), "guardado": state["counts"].get(k, 0), "real": counts.get(k, 0)})
+    for t in sorted(set(filas) | set(state["filas"])):
+        if filas.get(t, 0) != state["filas"].get(t, 0):
+            rows.append({"clave": f"filas {t}", "guardado": state["filas"].get(t, 0), "real": filas.get(t, 0)})
+    if fix and rows:
+        with state["lock"]:
+            state["counts"], state["filas"] = counts, filas
+            _kpi_save(state)
+    return pd.DataFrame(rows, columns=["clave", "guardado", "real"])
+
 def next_sequential_id(df: pd.DataFrame, id_col: str = "id") -> int:
     if df is None or df.empty or id_col not in df.columns:
         return 1
@@ -67,11 +1346,1514 @@ def next_sequential_id(df: pd.DataFrame, id_col: str = "id") -> int:
     except Exception:
         return 1
 
+# =========================
+# Secuencias de IDs persistentes
+# =========================
+# Un archivo <tabla>.seq por tabla con el último id entregado, protegido por un
+# lock de archivo entre procesos. La primera vez se inicializa con el máximo de
+# la tabla; después reservar N ids es O(1) y dos sesiones nunca reciben el mismo.
+SEQ_DIR = DATA_DIR / "_secuencias"
+
+@contextmanager
+def _file_lock(lock_path: Path):
+    """Lock exclusivo entre procesos (fcntl en Linux/Mac, msvcrt en Windows)."""
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+b") as fh:
+        if os.name == "nt":
+            import msvcrt
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+def _table_lock(path: Path):
+    """Lock entre procesos de una tabla: escrituras, rotación del journal y lecturas de snapshot + journal."""
+    return _file_lock(DATA_DIR / "_locks" / f"{path.stem}.lock")
+
+def _reserve_range(seq_path: Path, n: int, initial) -> range:
+    with _file_lock(seq_path.with_suffix(".lock")):
+        if seq_path.exists():
+            last = int(seq_path.read_text().strip() or 0)
+        else:
+            last = initial()
+        tmp = seq_path.with_suffix(".tmp")
+        with open(tmp, "w") as fh:
+            fh.write(str(last + n))
+            fh.flush()
+            os.fsync(fh.fileno())
+        tmp.replace(seq_path)
+    return range(last + 1, last + n + 1)
+
+def reserve_ids(path: Path, n: int = 1) -> range:
+    """Reserva `n` ids consecutivos para la tabla (un solo paso, seguro entre sesiones y procesos)."""
+    key = TABLE_KEYS.get(path) or "id"
+    return _reserve_range(SEQ_DIR / f"{path.stem}.seq", n,
+                          lambda: next_sequential_id(load_csv(path), key) - 1)
+
+def bench_id_allocator(n_rows: int = 1_000_000, reps: int = 200) -> pd.DataFrame:
+    """Compara next_sequential_id (scan del id) contra reserve_ids sobre una tabla de `n_rows`."""
+    df = pd.DataFrame({"id": np.arange(1, n_rows + 1)})
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        next_sequential_id(df, "id")
+    scan_us = (time.perf_counter() - t0) / reps * 1e6
+    with tempfile.TemporaryDirectory() as tmp:
+        seq = Path(tmp) / "bench.seq"
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            _reserve_range(seq, 1, lambda: n_rows)
+        seq_us = (time.perf_counter() - t0) / reps * 1e6
+        t0 = time.perf_counter()
+        _reserve_range(seq, 200, lambda: n_rows)
+        bulk_us = (time.perf_counter() - t0) * 1e6
+    rows = [
+        (f"next_sequential_id ({n_rows:,} filas)", 1, scan_us),
+        ("reserve_ids", 1, seq_us),
+        ("reserve_ids en bloque", 200, bulk_us),
+    ]
+    return pd.DataFrame([
+        {"método": m, "ids": k, "µs por reserva": round(us, 1), "µs por id": round(us / k, 2)}
+        for m, k, us in rows
+    ])
+
+# =========================
+# Journal append-only (APP_STORAGE=journal)
+# =========================
+# Cada tabla = snapshot <tabla>.csv + <tabla>.journal (una operación JSON por línea).
+# Al superar JOURNAL_COMPACT_BYTES, un hilo rota el journal a <tabla>.journal.compacting,
+# lo aplica sobre el snapshot y reescribe el snapshot. La lectura aplica
+# snapshot + compacting + journal; los inserts son upserts por clave, así que
+# reaplicar una operación ya compactada no duplica filas.
+@st.cache_resource(show_spinner=False)
+def _journal_state() -> dict:
+    return {"lock": threading.RLock(), "compacting": set(), "errores": {}}
+
+def _journal_path(path: Path) -> Path:
+    return path.with_suffix(".journal")
+
+def _compacting_path(path: Path) -> Path:
+    return path.with_suffix(".journal.compacting")
+
+def _json_default(v):
+    if isinstance(v, np.generic):
+        return v.item()
+    return str(v)
+
+def _append_journal(path: Path, ops: list, version_prev=None):
+    """Agrega las operaciones; devuelve la versión resultante, o None si la tabla ya no estaba en `version_prev`."""
+    payload = "".join(json.dumps(op, ensure_ascii=False, default=_json_default) + "\n" for op in ops)
+    with _journal_state()["lock"], _table_lock(path):
+        intacta = table_version(path) == version_prev
+        with open(_journal_path(path), "a", encoding="utf-8") as fh:
+            fh.write(payload)
+            fh.flush()
+            os.fsync(fh.fileno())
+        _bump_version(path)
+        version = table_version(path) if intacta else None
+    _maybe_compact(path)
+    return version
+
+def _read_journal(jpath: Path) -> list:
+    if not jpath.exists():
+        return []
+    ops = []
+    with open(jpath, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                ops.append(json.loads(line))
+            except ValueError:
+                # Última línea truncada por un corte: se ignora.
+                continue
+    return ops
+
+def _replay_journal(base: pd.DataFrame, ops: list, key) -> pd.DataFrame:
+    if not ops:
+        return base
+    inserts = {}   # clave -> fila insertada por el journal (conserva orden)
+    changes = {}   # clave -> columnas a actualizar sobre filas del snapshot
+    for op in ops:
+        if op.get("op") == "insert":
+            row = op["row"]
+            k = row.get(key) if key else len(inserts)
+            inserts[k] = dict(row)
+            changes.pop(k, None)
+        elif op.get("op") == "update" and key:
+            k = op["key"]
+            if k in inserts:
+                inserts[k].update(op["set"])
+            else:
+                changes.setdefault(k, {}).update(op["set"])
+
+    df = base.copy()
+    if key and not df.empty:
+        if changes:
+            for col in {c for vals in changes.values() for c in vals}:
+                df[col] = df[col].astype(object) if col in df.columns else ""
+            pos = pd.Index(df[key]).get_indexer(list(changes))
+            for p, vals in zip(pos, changes.values()):
+                if p < 0:
+                    continue
+                for col, val in vals.items():
+                    df.iat[p, df.columns.get_loc(col)] = val
+        if inserts:
+            df = df[~df[key].isin(list(inserts))]
+    if inserts:
+        new_rows = pd.DataFrame(list(inserts.values()))
+        df = new_rows if df.empty else pd.concat([df, new_rows], ignore_index=True)
+        cols = list(base.columns)
+        df = df[cols + [c for c in df.columns if c not in cols]]
+    return df.reset_index(drop=True).infer_objects()
+
+def _load_journaled(path: Path, dtypes=None, parse_dates=None, columns=None) -> pd.DataFrame:
+    key = TABLE_KEYS.get(path)
+    # La clave se lee siempre: el journal se aplica por clave.
+    leer = None if columns is None else list(columns) + ([key] if key and key not in columns else [])
+    # Bajo el lock para no mezclar un snapshot viejo con un journal ya compactado (de este u otro proceso).
+    with _journal_state()["lock"], _table_lock(path):
+        base = _safe_read_csv(path, dtypes=dtypes, parse_dates=parse_dates, columns=leer)
+        ops = _read_journal(_compacting_path(path)) + _read_journal(_journal_path(path))
+    df = _replay_journal(base, ops, key)
+    return df if columns is None else df[[c for c in columns if c in df.columns]]
+
+def _maybe_compact(path: Path):
+    jpath = _journal_path(path)
+    if not jpath.exists() or jpath.stat().st_size < JOURNAL_COMPACT_BYTES:
+        return
+    state = _journal_state()
+    with state["lock"]:
+        if path in state["compacting"]:
+            return
+        state["compacting"].add(path)
+    threading.Thread(target=_compact_journal, args=(path,), daemon=True,
+                     name=f"compact-{path.stem}").start()
+
+def _compact_journal(path: Path):
+    state = _journal_state()
+    jpath, cpath = _journal_path(path), _compacting_path(path)
+    try:
+        # Con el lock de la tabla: otro proceso no puede agregar al journal ya rotado y leído.
+        with state["lock"], _table_lock(path):
+            # Si quedó un compacting de una corrida anterior se termina ése primero.
+            if not cpath.exists() and jpath.exists():
+                jpath.replace(cpath)
+            base, base_version = _safe_read_csv(path), _stat_version(path)
+            ops = _read_journal(cpath)
+        df = _replay_journal(base, ops, TABLE_KEYS.get(path))
+        with state["lock"], _table_lock(path):
+            # Un save_csv en el medio ya reemplazó la tabla y descartó el journal: no se pisa.
+            if _stat_version(path) == base_version and cpath.exists():
+                _write_csv_atomic(df, path)
+                cpath.unlink(missing_ok=True)
+        state["errores"].pop(path.stem, None)
+    except Exception as e:
+        state["errores"][path.stem] = f"{type(e).__name__}: {e}"
+    finally:
+        with state["lock"]:
+            state["compacting"].discard(path)
+
+# =========================
+# SQLite en modo WAL (APP_STORAGE=sqlite)
+# =========================
+# Una conexión persistente por proceso (cache_resource) protegida con un lock;
+# WAL permite que otros procesos lean mientras se escribe. Los inserts y updates
+# se ejecutan fila a fila en lugar de reescribir la tabla completa.
+@st.cache_resource(show_spinner=False)
+def _sqlite_state() -> dict:
+    conn = sqlite3.connect(SQLITE_PATH, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("CREATE TABLE IF NOT EXISTS _table_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+    return {"conn": conn, "lock": threading.RLock()}
+
+@contextmanager
+def _sqlite_tx():
+    state = _sqlite_state()
+    with state["lock"]:
+        conn = state["conn"]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+def _sqlite_table(path: Path) -> str:
+    return path.stem
+
+def _sqlite_bump(conn: sqlite3.Connection, path: Path):
+    # Dentro de la misma transacción que la escritura, visible para otros procesos.
+    conn.execute("INSERT INTO _table_versions (name, version) VALUES (?, 1) "
+                 "ON CONFLICT(name) DO UPDATE SET version = version + 1", (_sqlite_table(path),))
+
+def _sqlite_version(path: Path) -> int:
+    state = _sqlite_state()
+    with state["lock"]:
+        row = state["conn"].execute("SELECT version FROM _table_versions WHERE name=?",
+                                    (_sqlite_table(path),)).fetchone()
+    return row[0] if row else 0
+
+def _sqlite_value(v):
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, bool):
+        return int(v)
+    return v
+
+def _sqlite_has_table(path: Path) -> bool:
+    state = _sqlite_state()
+    with state["lock"]:
+        row = state["conn"].execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (_sqlite_table(path),)
+        ).fetchone()
+    return row is not None
+
+def _sqlite_create_indexes(conn: sqlite3.Connection, path: Path, columns):
+    t = _sqlite_table(path)
+    key = TABLE_KEYS.get(path)
+    if key in columns:
+        conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{t}_{key}" ON "{t}" ("{key}")')
+    for col in SQLITE_INDEXED:
+        if col in columns and col != key:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{t}_{col}" ON "{t}" ("{col}")')
+
+def _sqlite_replace(df: pd.DataFrame, path: Path):
+    t = _sqlite_table(path)
+    cols = ", ".join(f'"{c}" {SQLITE_COLUMN_TYPES.get(c, "TEXT")}' for c in df.columns)
+    with _sqlite_tx() as conn:
+        conn.execute(f'DROP TABLE IF EXISTS "{t}"')
+        conn.execute(f'CREATE TABLE "{t}" ({cols})')
+        if not df.empty:
+            marks = ", ".join("?" for _ in df.columns)
+            conn.executemany(f'INSERT INTO "{t}" VALUES ({marks})',
+                             ([_sqlite_value(v) for v in row] for row in df.itertuples(index=False)))
+        _sqlite_create_indexes(conn, path, list(df.columns))
+        _sqlite_bump(conn, path)
+
+def _sqlite_load(path: Path, columns=None) -> pd.DataFrame:
+    if not _sqlite_has_table(path):
+        return pd.DataFrame()
+    state = _sqlite_state()
+    with state["lock"]:
+        names = "*"
+        if columns is not None:
+            names = ", ".join(f'"{c}"' for c in columns if c in _sqlite_columns(state["conn"], path)) or "*"
+        df = pd.read_sql_query(f'SELECT {names} FROM "{_sqlite_table(path)}" ORDER BY rowid', state["conn"])
+    if "en_rango" in df.columns:
+        df["en_rango"] = df["en_rango"].astype(bool)
+    return df
+
+def _sqlite_columns(conn: sqlite3.Connection, path: Path) -> list:
+    return [r[1] for r in conn.execute(f'PRAGMA table_info("{_sqlite_table(path)}")')]
+
+def _sqlite_insert(conn: sqlite3.Connection, path: Path, rows: list):
+    if not rows:
+        return
+    t = _sqlite_table(path)
+    existing = _sqlite_columns(conn, path)
+    for col in dict.fromkeys(c for r in rows for c in r):
+        if col not in existing:
+            conn.execute(f'ALTER TABLE "{t}" ADD COLUMN "{col}" {SQLITE_COLUMN_TYPES.get(col, "TEXT")}')
+            existing.append(col)
+    cols = [c for c in existing if any(c in r for r in rows)]
+    names = ", ".join(f'"{c}"' for c in cols)
+    marks = ", ".join("?" for _ in cols)
+    conn.executemany(f'INSERT INTO "{t}" ({names}) VALUES ({marks})',
+                     ([_sqlite_value(r.get(c, "")) for c in cols] for r in rows))
+
+def _sqlite_update(conn: sqlite3.Connection, path: Path, key_value, values: dict) -> bool:
+    sets = ", ".join(f'"{c}" = ?' for c in values)
+    cur = conn.execute(f'UPDATE "{_sqlite_table(path)}" SET {sets} WHERE "{TABLE_KEYS[path]}" = ?',
+                       [_sqlite_value(v) for v in values.values()] + [_sqlite_value(key_value)])
+    return cur.rowcount > 0
+
+def _sqlite_apply(path: Path, muts: list, version_prev=None) -> tuple:
+    """Lote de inserts/updates de una tabla en una sola transacción: (resultados, versión resultante).
+
+    La versión se lee dentro de la transacción (BEGIN IMMEDIATE: ningún otro proceso
+    escribe); es None si la tabla ya no estaba en `version_prev`.
+    """
+    key = TABLE_KEYS.get(path)
+    results = []
+    with _sqlite_tx() as conn:
+        intacta = table_version(path) == version_prev
+        for m in muts:
+            if m["op"] == "insert":
+                _sqlite_insert(conn, path, m["rows"])
+                results.append([r.get(key) for r in m["rows"]])
+            else:
+                results.append(_sqlite_update(conn, path, m["key"], m["values"]))
+        _sqlite_bump(conn, path)
+        _bump_version(path)
+        version = table_version(path) if intacta else None
+    return results, version
+
+def migrate_csv_to_sqlite():
+    """Importa a SQLite los CSV existentes (y su journal, si lo hay) cuyas tablas aún no existen."""
+    for path in TABLE_KEYS:
+        if _sqlite_has_table(path) or not path.exists():
+            continue
+        df = _load_journaled(path) if _journal_path(path).exists() else _safe_read_csv(path)
+        if df.empty and len(df.columns) == 0:
+            continue
+        _sqlite_replace(df, path)
+
+# =========================
+# Rondas en Parquet particionado (APP_RONDAS_STORE=parquet)
+# =========================
+# Cada "Guardar ronda" escribe un archivo chico en su partición mes/plantilla;
+# cuando una partición acumula muchos archivos se reescribe en uno solo.
+# Las lecturas listan sólo las particiones del rango pedido y filtran `ts`
+# dentro de los row groups (predicate pushdown).
+RONDAS_PARQUET_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("ts", pa.timestamp("ms", tz="UTC")),
+    ("tag", pa.dictionary(pa.int32(), pa.string())),
+    ("variable", pa.dictionary(pa.int32(), pa.string())),
+    ("valor", pa.float32()),
+    ("en_rango", pa.bool_()),
+    ("operario", pa.dictionary(pa.int32(), pa.string())),
+])
+RONDAS_PARTITIONING = pads.partitioning(
+    pa.schema([("mes", pa.string()), ("plantilla", pa.string())]), flavor="hive"
+)
+RONDAS_COLUMNS = ["id", "ts", "plantilla", "tag", "variable", "valor", "en_rango", "operario"]
+
+def _is_parquet(path: Path) -> bool:
+    return RONDAS_STORE == "parquet" and path == F_RONDAS_RUN
+
+@st.cache_resource(show_spinner=False)
+def _parquet_lock() -> threading.Lock:
+    return threading.Lock()
+
+def _parquet_touch_version():
+    marker = RONDAS_PARQUET_DIR / "_version"
+    n = int(marker.read_text() or 0) + 1 if marker.exists() else 1
+    tmp = marker.with_suffix(".tmp")
+    tmp.write_text(str(n))
+    tmp.replace(marker)
+
+def _partition_dir(mes: str, plantilla: str) -> Path:
+    return RONDAS_PARQUET_DIR / f"mes={mes}" / f"plantilla={quote(str(plantilla), safe='')}"
+
+def _parquet_write_file(table: pa.Table, part_dir: Path):
+    part_dir.mkdir(parents=True, exist_ok=True)
+    name = f"part-{datetime.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}.parquet"
+    tmp = part_dir / f".{name}.tmp"
+    pq.write_table(table, tmp)
+    tmp.replace(part_dir / name)
+
+def _parquet_append(df: pd.DataFrame):
+    if df.empty:
+        return
+    df = df.copy()
+    df["ts"] = _coerce_column(df["ts"], "epoch_ms")
+    df["mes"] = df["ts"].dt.tz_convert(APP_TZ).dt.strftime("%Y-%m")
+    file_cols = [f.name for f in RONDAS_PARQUET_SCHEMA]
+    with _parquet_lock():
+        for (mes, plantilla), part in df.groupby(["mes", "plantilla"], sort=False):
+            table = pa.Table.from_pandas(part[file_cols], preserve_index=False).cast(RONDAS_PARQUET_SCHEMA)
+            part_dir = _partition_dir(mes, plantilla)
+            _parquet_write_file(table, part_dir)
+            _parquet_compact_partition(part_dir)
+        _parquet_touch_version()
+
+def _parquet_compact_partition(part_dir: Path):
+    files = sorted(part_dir.glob("part-*.parquet"))
+    if len(files) <= RONDAS_PARTITION_MAX_FILES:
+        return
+    merged = pa.concat_tables([pq.read_table(f, schema=RONDAS_PARQUET_SCHEMA) for f in files])
+    _parquet_write_file(merged.sort_by("ts"), part_dir)
+    for f in files:
+        f.unlink(missing_ok=True)
+
+def _parquet_replace(df: pd.DataFrame):
+    with _parquet_lock():
+        if RONDAS_PARQUET_DIR.exists():
+            for child in RONDAS_PARQUET_DIR.iterdir():
+                if child.is_dir():
+                    shutil.rmtree(child)
+        RONDAS_PARQUET_DIR.mkdir(parents=True, exist_ok=True)
+    _parquet_append(df)
+    with _parquet_lock():
+        _parquet_touch_version()
+
+def _month_dirs(desde=None, hasta=None) -> list:
+    if not RONDAS_PARQUET_DIR.exists():
+        return []
+    # Las particiones son meses en la zona de planta.
+    lo = as_utc(desde).tz_convert(APP_TZ).strftime("%Y-%m") if desde is not None else None
+    hi = as_utc(hasta).tz_convert(APP_TZ).strftime("%Y-%m") if hasta is not None else None
+    dirs = []
+    for d in RONDAS_PARQUET_DIR.glob("mes=*"):
+        mes = d.name.split("=", 1)[1]
+        if (lo is None or mes >= lo) and (hi is None or mes <= hi):
+            dirs.append(d)
+    return sorted(dirs, key=lambda d: d.name)
+
+def _parquet_read(desde=None, hasta=None, plantilla=None, columns=None, month_dirs=None) -> pd.DataFrame:
+    """Lee sólo las particiones necesarias y filtra `ts` en el escaneo."""
+    if month_dirs is None:
+        month_dirs = _month_dirs(desde, hasta)
+    files = []
+    for d in month_dirs:
+        pattern = f"plantilla={quote(str(plantilla), safe='')}/part-*.parquet" if plantilla else "plantilla=*/part-*.parquet"
+        files.extend(str(f) for f in d.glob(pattern))
+    cols = columns or RONDAS_COLUMNS
+    if not files:
+        return pd.DataFrame(columns=cols)
+    dataset = pads.dataset(files, format="parquet", schema=RONDAS_PARQUET_SCHEMA.append(pa.field("mes", pa.string()))
+                           .append(pa.field("plantilla", pa.string())),
+                           partitioning=RONDAS_PARTITIONING, partition_base_dir=str(RONDAS_PARQUET_DIR))
+    filt = None
+    if desde is not None:
+        filt = pads.field("ts") >= pa.scalar(as_utc(desde).to_pydatetime(), pa.timestamp("ms", tz="UTC"))
+    if hasta is not None:
+        cond = pads.field("ts") <= pa.scalar(as_utc(hasta).to_pydatetime(), pa.timestamp("ms", tz="UTC"))
+        filt = cond if filt is None else filt & cond
+    table = dataset.to_table(columns=cols, filter=filt)
+    return table.to_pandas()
+
+def read_rondas_run(desde=None, hasta=None, plantilla=None, columns=None) -> pd.DataFrame:
+    """Ejecuciones de rondas en [desde, hasta], opcionalmente de una plantilla y con columnas proyectadas."""
+    if RONDAS_STORE == "parquet":
+        return _parquet_read(desde, hasta, plantilla, columns)
+    df = load_csv(F_RONDAS_RUN)
+    if df.empty:
+        return df
+    ts = df["ts"]
+    mask = pd.Series(True, index=df.index)
+    if desde is not None:
+        mask &= ts >= as_utc(desde)
+    if hasta is not None:
+        mask &= ts <= as_utc(hasta)
+    if plantilla:
+        mask &= df["plantilla"] == plantilla
+    out = df[mask]
+    return out[columns] if columns else out
+
+def latest_rondas_run(n: int = 20) -> pd.DataFrame:
+    """Las `n` ejecuciones más recientes; en Parquet recorre los meses de más nuevo a más viejo."""
+    if RONDAS_STORE != "parquet":
+        df = load_csv(F_RONDAS_RUN)
+        return df.sort_values("ts", ascending=False).head(n) if not df.empty else df
+    parts = []
+    got = 0
+    for d in reversed(_month_dirs()):
+        chunk = _parquet_read(month_dirs=[d])
+        parts.append(chunk)
+        got += len(chunk)
+        if got >= n:
+            break
+    if not parts:
+        return pd.DataFrame(columns=RONDAS_COLUMNS)
+    return pd.concat(parts, ignore_index=True).sort_values(["ts", "id"], ascending=False).head(n)
+
+def ronda_plantilla(plantilla: str) -> pd.DataFrame:
+    """Puntos de control de la plantilla con el valor sugerido (punto medio), por versión de plantillas."""
+    def build():
+        df = load_csv(F_RONDAS_PLT)
+        sub = df[df["plantilla"] == plantilla]
+        out = pd.DataFrame({"tag": sub["tag"].astype(str).to_numpy(),
+                            "variable": sub["variable"].astype(str).to_numpy(),
+                            "lim_inf": sub["lim_inf"].to_numpy(), "lim_sup": sub["lim_sup"].to_numpy()})
+        out["valor"] = (out["lim_inf"] + out["lim_sup"]) / 2
+        return out
+    return derived(F_RONDAS_PLT, f"ronda:{plantilla}", build)
+
+def lecturas_ronda(plantilla: str, operario: str, lecturas: pd.DataFrame) -> pd.DataFrame:
+    """Filas de ejecución de una ronda completa: rango evaluado en bloque y un solo timestamp.
+
+    Los puntos sin valor se omiten. Los ids los asigna el escritor al hacer el commit.
+    """
+    lect = lecturas[lecturas["valor"].notna()]
+    # En float32, igual que se guardan `valor` y los límites.
+    valor = lect["valor"].to_numpy(dtype="float32")
+    en_rango = (valor >= lect["lim_inf"].to_numpy(dtype="float32")) & (valor <= lect["lim_sup"].to_numpy(dtype="float32"))
+    return pd.DataFrame({"ts": now_ms(), "plantilla": plantilla, "tag": lect["tag"].to_numpy(),
+                         "variable": lect["variable"].to_numpy(), "valor": valor,
+                         "en_rango": en_rango, "operario": operario})
+
+# Notificaciones automáticas de rondas: prioridad según el desvío respecto del límite,
+# relativo al ancho del rango [lim_inf, lim_sup]; por debajo del último umbral, P3.
+RONDA_DESVIO_PRIORIDAD = ((0.5, "P1"), (0.2, "P2"))
+NOTIF_ABIERTAS = ["Pendiente", "Recibida"]
+
+@st.cache_resource(show_spinner=False)
+def _alertas_ronda_lock() -> threading.Lock:
+    # Serializa "buscar abiertas + crear" para no duplicar entre sesiones.
+    return threading.Lock()
+
+def _titulo_fuera_de_rango(tag: str, variable: str) -> str:
+    return f"Fuera de rango {tag} · {variable}"
+
+def _notif_abiertas(tags) -> dict:
+    """{título: id} de las notificaciones no completadas de esos tags, vía índices secundarios."""
+    df = _cached_table(F_NOTIF)
+    if df.empty:
+        return {}
+    pos_tag = index_positions(F_NOTIF, "tag", tags)
+    pos_est = index_positions(F_NOTIF, "estado", NOTIF_ABIERTAS)
+    if pos_tag is None or pos_est is None:
+        sub = df.loc[df["tag"].isin(tags) & df["estado"].isin(NOTIF_ABIERTAS), ["titulo", "id"]]
+    else:
+        sub = df[["titulo", "id"]].iloc[np.intersect1d(pos_tag, pos_est, assume_unique=True)]
+    return dict(zip(sub["titulo"].astype(str), sub["id"].tolist()))
+
+def notif_abierta(key_value) -> bool:
+    row = get_row(F_NOTIF, key_value)
+    return row is not None and str(row["estado"]) in NOTIF_ABIERTAS
+
+def alertas_ronda(plantilla: str, operario: str, lecturas: pd.DataFrame, ts: int) -> list:
+    """Notificaciones para las lecturas fuera de rango: una por (tag, variable), con la peor lectura.
+
+    Se omiten los pares que ya tienen una notificación abierta.
+    """
+    lect = lecturas[lecturas["valor"].notna()]
+    valor = lect["valor"].to_numpy(dtype="float32")
+    li = lect["lim_inf"].to_numpy(dtype="float32")
+    ls = lect["lim_sup"].to_numpy(dtype="float32")
+    desvio = np.maximum(li - valor, valor - ls)   # > 0 sólo fuera de rango
+    fuera = desvio > 0
+    if not fuera.any():
+        return []
+    ancho = np.where(ls > li, ls - li, np.maximum(np.abs(ls), 1))
+    relativo = desvio / ancho
+    prioridad = np.select([relativo >= u for u, _ in RONDA_DESVIO_PRIORIDAD],
+                          [p for _, p in RONDA_DESVIO_PRIORIDAD], "P3")
+    f = pd.DataFrame({"tag": lect["tag"].astype(str).to_numpy(), "variable": lect["variable"].astype(str).to_numpy(),
+                      "valor": valor, "lim_inf": li, "lim_sup": ls, "relativo": relativo,
+                      "prioridad": prioridad})[fuera]
+    f = f.sort_values("relativo", ascending=False, kind="stable").drop_duplicates(["tag", "variable"])
+    f["titulo"] = [_titulo_fuera_de_rango(t, v) for t, v in zip(f["tag"], f["variable"])]
+    f = f[~f["titulo"].isin(list(_notif_abiertas(f["tag"].unique().tolist())))]
+    return [{
+        "ts_creacion": ts, "tag": r.tag, "titulo": r.titulo,
+        "motivo": f"{r.variable}={r.valor:g} fuera de [{r.lim_inf:g}, {r.lim_sup:g}]",
+        "prioridad": r.prioridad, "estado": "Pendiente", "asignado_a": operario,
+        "ts_recibida": "", "ts_cerrada": "", "evidencia": f"Ronda {plantilla}",
+    } for r in f.itertuples(index=False)]
+
+def guardar_ronda(plantilla: str, operario: str, lecturas: pd.DataFrame) -> tuple:
+    """Commit de una ronda: lecturas en un insert y sus notificaciones fuera de rango en otro.
+
+    Devuelve (filas guardadas, ids de notificaciones creadas).
+    """
+    rows = lecturas_ronda(plantilla, operario, lecturas)
+    if rows.empty:
+        return rows, []
+    # Un solo insert: el escritor reserva los ids de todas las lecturas en un paso.
+    insert_rows(F_RONDAS_RUN, rows.to_dict("records"))
+    with _alertas_ronda_lock():
+        alertas = alertas_ronda(plantilla, operario, lecturas, int(rows["ts"].iloc[0]))
+        ids = insert_rows(F_NOTIF, alertas) if alertas else []
+    return rows, ids
+
+def _parquet_has_legacy_ts() -> bool:
+    files = sorted(RONDAS_PARQUET_DIR.glob("mes=*/plantilla=*/part-*.parquet"))
+    return bool(files) and pq.read_schema(files[0]).field("ts").type.tz is None
+
+def migrate_timestamps():
+    """Reescribe en epoch ms las fechas guardadas como texto local (formato anterior).
+
+    La lectura ya entiende ambos formatos; esto deja el almacenamiento numérico.
+    """
+    if APP_TZ_SIN_DEFINIR:
+        return   # con UTC supuesto las fechas locales quedarían corridas para siempre
+    for path, schema in TABLE_SCHEMAS.items():
+        cols = [c for c, kind in schema.items() if kind == "epoch_ms"]
+        if not cols or not table_exists(path):
+            continue
+        if _is_parquet(path):
+            if _parquet_has_legacy_ts():
+                legacy = RONDAS_PARQUET_SCHEMA.set(
+                    RONDAS_PARQUET_SCHEMA.get_field_index("ts"), pa.field("ts", pa.timestamp("ms")))
+                files = [str(f) for f in RONDAS_PARQUET_DIR.glob("mes=*/plantilla=*/part-*.parquet")]
+                dataset = pads.dataset(files, format="parquet", schema=legacy.append(pa.field("mes", pa.string()))
+                                       .append(pa.field("plantilla", pa.string())),
+                                       partitioning=RONDAS_PARTITIONING, partition_base_dir=str(RONDAS_PARQUET_DIR))
+                save_csv(dataset.to_table(columns=RONDAS_COLUMNS).to_pandas(), path)
+            continue
+        raw = _read_backend(path)
+        cols = [c for c in cols if c in raw.columns and raw[c].dtype == object
+                and raw[c].astype(str).str.contains("-").any()]
+        if not cols:
+            continue
+        # Si alguna fecha no se puede interpretar, la tabla queda como está: reescribirla la borraría.
+        malas = {c: int((raw[c].astype(str).str.strip().ne("") & raw[c].notna()
+                         & _coerce_column(raw[c], "epoch_ms").isna()).sum()) for c in cols}
+        if any(malas.values()):
+            detalle = ", ".join(f"{c}: {n}" for c, n in malas.items() if n)
+            st.warning(f"{path.name}: fechas que no se pudieron interpretar ({detalle}); no se migra a epoch ms.")
+            continue
+        save_csv(raw, path)
+
+@st.cache_resource(show_spinner=False)
+def _timestamps_migrated() -> bool:
+    # Una vez por proceso.
+    migrate_timestamps()
+    return True
+
+def migrate_rondas_to_parquet():
+    """Importa rondas_ejecuciones.csv (o su tabla) al store Parquet si todavía no existe."""
+    if table_exists(F_RONDAS_RUN) or not _backend_has_table(F_RONDAS_RUN):
+        return
+    df = _read_backend(F_RONDAS_RUN)
+    save_csv(df.reindex(columns=RONDAS_COLUMNS), F_RONDAS_RUN)
+
+# =========================
+# Operadores de ventana (streaming)
+# =========================
+# Cada operador recibe (ts_ms, valor) en orden y devuelve su salida, o None si no
+# emite. Son O(1) amortizado por muestra: buffers circulares con suma corrida y
+# deques monótonos para mínimo/máximo. Las ventanas son por tiempo y además tienen
+# un tope de VENTANA_MAX_MUESTRAS, así la memoria por tag queda acotada aunque el
+# stream no termine. Se componen en cadena con "|", p. ej. "banda:0.1|tasa:60".
+VENTANA_MAX_MUESTRAS = 4096
+
+class Media:
+    """Media móvil de los últimos `segundos`."""
+
+    def __init__(self, segundos: float):
+        self.ms = segundos * 1000
+        self.buf = deque()
+        self.suma = 0.0
+
+    def update(self, ts: int, x: float):
+        self.buf.append((ts, x))
+        self.suma += x
+        while self.buf and (self.buf[0][0] <= ts - self.ms or len(self.buf) > VENTANA_MAX_MUESTRAS):
+            self.suma -= self.buf.popleft()[1]
+        return self.suma / len(self.buf)
+
+class Tasa:
+    """Tasa de cambio por minuto respecto de la muestra más vieja de la ventana."""
+
+    def __init__(self, segundos: float):
+        self.ms = segundos * 1000
+        self.buf = deque(maxlen=VENTANA_MAX_MUESTRAS)
+
+    def update(self, ts: int, x: float):
+        self.buf.append((ts, x))
+        while self.buf[0][0] < ts - self.ms:
+            self.buf.popleft()
+        t0, x0 = self.buf[0]
+        return None if ts == t0 else (x - x0) / ((ts - t0) / 60_000)
+
+class _Extremo:
+    """Mínimo (signo 1) o máximo (signo -1) de la ventana con un deque monótono."""
+    signo = 1
+
+    def __init__(self, segundos: float):
+        self.ms = segundos * 1000
+        self.buf = deque()   # (ts, valor, n) con valores monótonos
+        self.n = 0
+
+    def update(self, ts: int, x: float):
+        self.n += 1
+        while self.buf and self.signo * self.buf[-1][1] >= self.signo * x:
+            self.buf.pop()
+        self.buf.append((ts, x, self.n))
+        while self.buf[0][0] <= ts - self.ms or self.buf[0][2] <= self.n - VENTANA_MAX_MUESTRAS:
+            self.buf.popleft()
+        return self.buf[0][1]
+
+class Minimo(_Extremo):
+    signo = 1
+
+class Maximo(_Extremo):
+    signo = -1
+
+class Banda:
+    """Banda muerta: sólo deja pasar la muestra si se movió al menos `banda` desde la última emitida."""
+
+    def __init__(self, banda: float):
+        self.banda = banda
+        self.ultimo = None
+
+    def update(self, ts: int, x: float):
+        if self.ultimo is not None and abs(x - self.ultimo) < self.banda:
+            return None
+        self.ultimo = x
+        return x
+
+OPERADORES = {"media": Media, "tasa": Tasa, "min": Minimo, "max": Maximo, "banda": Banda}
+
+class Cadena:
+    """Operadores aplicados en orden; si uno no emite, la muestra no llega a la regla."""
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        self.ops = [OPERADORES[nombre](param) for nombre, param in parse_operador(spec)]
+
+    def update(self, ts: int, x: float):
+        for op in self.ops:
+            x = op.update(ts, x)
+            if x is None:
+                return None
+        return x
+
+def parse_operador(spec: str) -> list:
+    """"media:300|tasa:60" -> [("media", 300.0), ("tasa", 60.0)]; ValueError si no es válido."""
+    pasos = []
+    for paso in filter(None, (p.strip() for p in str(spec).split("|"))):
+        nombre, _, param = paso.partition(":")
+        nombre = nombre.strip().lower()
+        if nombre not in OPERADORES:
+            raise ValueError(f"Operador desconocido: {nombre!r} (válidos: {', '.join(OPERADORES)})")
+        try:
+            valor = float(param)
+        except ValueError:
+            raise ValueError(f"Parámetro inválido en {paso!r}: se espera un número (segundos o banda)")
+        if valor <= 0:
+            raise ValueError(f"Parámetro inválido en {paso!r}: debe ser mayor que 0")
+        pasos.append((nombre, valor))
+    return pasos
+
+# =========================
+# Reglas IoT (umbrales)
+# =========================
+# Tabla editable desde Config & IoT: una fila por (tag, variable, comparador, límite).
+# Las reglas activas se compilan a arrays NumPy agrupados por par (tag, variable);
+# un lote de lecturas se cruza con sus reglas con searchsorted/repeat y se compara
+# en una sola pasada. La compilación se rehace sólo cuando cambia la versión de la tabla.
+# Las reglas con `operador` (media, tasa, min, max, banda) comparan la salida de su
+# cadena de ventana en lugar de la lectura cruda; sólo esos pares se recorren en orden.
+REGLA_COMPARADORES = [">", ">=", "<", "<="]
+REGLAS_COLUMNS = ["id", "tag", "variable", "operador", "comparador", "limite", "prioridad", "asignado_a", "area",
+                  "activa", "banda_muerta", "retardo_on_s", "retardo_off_s"]
+
+def _index_of(index: pd.Index, s: pd.Series) -> np.ndarray:
+    """Posición de cada valor de `s` en `index` (-1 si no está); con categorías se resuelve por categoría."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        codes = s.cat.codes.to_numpy()
+        lut = index.get_indexer(s.cat.categories.astype(str))
+        return np.where(codes >= 0, lut[codes], -1)
+    return index.get_indexer(s.astype(str))
+
+def compile_rules(df: pd.DataFrame) -> dict:
+    """Reglas activas como arrays, ordenadas por par (tag, variable) con inicio y cantidad por par."""
+    df = df.reindex(columns=REGLAS_COLUMNS)
+    df = df[df["activa"].fillna(False).astype(bool).to_numpy()
+            & df["comparador"].astype(object).isin(REGLA_COMPARADORES).to_numpy()]
+    texto = {c: df[c].astype(object).fillna("").astype(str).to_numpy(dtype=object)
+             for c in ("tag", "variable", "operador", "comparador", "prioridad", "asignado_a", "area")}
+    tags, variables = pd.Index(pd.unique(texto["tag"])), pd.Index(pd.unique(texto["variable"]))
+    par = tags.get_indexer(texto["tag"]).astype("int64") * len(variables) + variables.get_indexer(texto["variable"])
+    order = np.argsort(par, kind="stable")
+    pares, inicio, cantidad = np.unique(par[order], return_index=True, return_counts=True)
+    texto = {c: v[order] for c, v in texto.items()}
+    return {
+        "tags": tags, "variables": variables, "pares": pares, "inicio": inicio, "cantidad": cantidad,
+        "id": df["id"].to_numpy(dtype="int64")[order], "tag": texto["tag"], "variable": texto["variable"],
+        "operador": texto["operador"], "ventana": texto["operador"] != "",
+        "comparador": pd.Index(REGLA_COMPARADORES).get_indexer(texto["comparador"]).astype("int8"),
+        "limite": df["limite"].to_numpy(dtype="float32")[order], "prioridad": texto["prioridad"],
+        "banda_muerta": df["banda_muerta"].fillna(0).to_numpy(dtype="float32")[order],
+        "retardo_on": (df["retardo_on_s"].fillna(0).to_numpy(dtype="float64")[order] * 1000).astype("int64"),
+        "retardo_off": (df["retardo_off_s"].fillna(0).to_numpy(dtype="float64")[order] * 1000).astype("int64"),
+        # Sin responsable, la notificación queda asignada al área.
+        "asignado_a": np.where(texto["asignado_a"] != "", texto["asignado_a"], texto["area"]),
+    }
+
+def compiled_rules() -> dict:
+    """Reglas de la tabla compiladas; se recompilan sólo cuando cambia su versión."""
+    return derived(F_REGLAS, "compiladas", lambda: compile_rules(load_csv(F_REGLAS)))
+
+def evaluar_reglas(lote: pd.DataFrame, reglas: dict) -> pd.DataFrame:
+    """Pares (lectura, regla) del lote: regla, valor, ts, exceso y si la regla se cumple (`hit`).
+
+    `regla` es la posición en los arrays compilados; `exceso` es cuánto pasa el límite
+    en el sentido de la regla (negativo si no llega).
+    """
+    vacio = pd.DataFrame({"regla": np.empty(0, dtype="int64"), "valor": np.empty(0, dtype="float32"),
+                          "ts": np.empty(0, dtype="int64"), "exceso": np.empty(0, dtype="float32"),
+                          "hit": np.empty(0, dtype=bool)})
+    if lote.empty or not len(reglas["pares"]):
+        return vacio
+    t = _index_of(reglas["tags"], lote["tag"]).astype("int64")
+    v = _index_of(reglas["variables"], lote["variable"]).astype("int64")
+    par = t * len(reglas["variables"]) + v
+    j = np.minimum(np.searchsorted(reglas["pares"], par), len(reglas["pares"]) - 1)
+    lect = np.flatnonzero((t >= 0) & (v >= 0) & (reglas["pares"][j] == par))
+    if not len(lect):
+        return vacio
+    # Cada lectura se repite una vez por regla de su par.
+    j = j[lect]
+    cantidad = reglas["cantidad"][j]
+    fila = np.repeat(lect, cantidad)
+    desde = np.repeat(np.cumsum(cantidad) - cantidad, cantidad)
+    regla = np.repeat(reglas["inicio"][j], cantidad) + (np.arange(len(fila)) - desde)
+    valor = lote["valor"].to_numpy(dtype="float32")[fila]
+    hit, exceso = _comparar(reglas, regla, valor)
+    return pd.DataFrame({"regla": regla, "valor": valor, "ts": lote["ts"].to_numpy(dtype="int64")[fila],
+                         "exceso": exceso, "hit": hit})
+
+def _comparar(reglas: dict, regla: np.ndarray, valor: np.ndarray) -> tuple:
+    """(se cumple, exceso sobre el límite en el sentido de la regla) para cada par."""
+    limite, comp = reglas["limite"][regla], reglas["comparador"][regla]
+    hit = np.select([comp == 0, comp == 1, comp == 2], [valor > limite, valor >= limite, valor < limite],
+                    valor <= limite)
+    return hit, np.where(comp <= 1, valor - limite, limite - valor)
+
+def aplicar_operadores(pares: pd.DataFrame, reglas: dict, cadenas: dict) -> pd.DataFrame:
+    """Pasa los pares de reglas con operador por su cadena de ventana (por regla, en orden de ts).
+
+    `cadenas` guarda {id de regla: Cadena} entre lotes; si cambia el operador de una
+    regla su cadena se reinicia. Los pares cuya cadena no emite se descartan.
+    """
+    ventana = reglas["ventana"][pares["regla"].to_numpy()]
+    if not ventana.any():
+        return pares
+    sub = pares[ventana]
+    sub = sub.iloc[np.lexsort((sub["ts"].to_numpy(), sub["regla"].to_numpy()))]
+    salida = []
+    for k, ts, x in zip(sub["regla"].tolist(), sub["ts"].tolist(), sub["valor"].tolist()):
+        rid, spec = int(reglas["id"][k]), reglas["operador"][k]
+        cadena = cadenas.get(rid)
+        if cadena is None or cadena.spec != spec:
+            cadena = cadenas[rid] = Cadena(spec)
+        salida.append(cadena.update(ts, x))
+    valor = pd.array(salida, dtype="Float32").to_numpy(dtype="float32", na_value=np.nan)
+    emite = ~np.isnan(valor)
+    regla = sub["regla"].to_numpy()[emite]
+    hit, exceso = _comparar(reglas, regla, valor[emite])
+    calculados = pd.DataFrame({"regla": regla, "valor": valor[emite], "ts": sub["ts"].to_numpy()[emite],
+                               "exceso": exceso, "hit": hit})
+    return pd.concat([pares[~ventana], calculados], ignore_index=True)
+
+def corridas_reglas(pares: pd.DataFrame, reglas: dict) -> pd.DataFrame:
+    """Comprime los pares (lectura, regla) en tramos consecutivos de igual clase por regla, en orden de ts.
+
+    clase 1 = la regla se cumple, -1 = normalizada (salió de la banda muerta), 0 = dentro
+    de la banda muerta. Cada tramo trae desde/hasta, cantidad de lecturas y el mayor exceso.
+    """
+    regla, ts, exceso = (pares["regla"].to_numpy(), pares["ts"].to_numpy(), pares["exceso"].to_numpy())
+    clase = np.where(pares["hit"].to_numpy(), 1, np.where(exceso < -reglas["banda_muerta"][regla], -1, 0))
+    order = np.lexsort((ts, regla))
+    regla, clase, ts, exceso = regla[order], clase[order], ts[order], exceso[order]
+    nuevo = np.ones(len(regla), dtype=bool)
+    nuevo[1:] = (regla[1:] != regla[:-1]) | (clase[1:] != clase[:-1])
+    ini = np.flatnonzero(nuevo)
+    fin = np.append(ini[1:], len(regla)) - 1
+    return pd.DataFrame({"regla": regla[ini], "clase": clase[ini], "desde": ts[ini], "hasta": ts[fin],
+                         "lecturas": fin - ini + 1,
+                         "pico": np.maximum.reduceat(exceso, ini) if len(ini) else exceso[:0]})
+
+def _titulo_regla(reglas: dict, k: int) -> str:
+    operador = f" [{reglas['operador'][k]}]" if reglas["operador"][k] else ""
+    return (f"Regla {reglas['id'][k]}: {reglas['tag'][k]} {reglas['variable'][k]}{operador} "
+            f"{REGLA_COMPARADORES[reglas['comparador'][k]]} {reglas['limite'][k]:g}")
+
+def _medida(reglas: dict, k: int) -> str:
+    """Lo que compara la regla: la variable o su operador de ventana."""
+    return f"{reglas['variable'][k]} {reglas['operador'][k]}".strip()
+
+def _valor_pico(reglas: dict, k: int, pico: float) -> float:
+    """Valor de la lectura que pasó el límite por `pico`, en el sentido de la regla."""
+    return float(reglas["limite"][k] + pico if reglas["comparador"][k] <= 1 else reglas["limite"][k] - pico)
+
+def guardar_reglas(df: pd.DataFrame):
+    """Reemplaza la tabla de reglas con lo editado; descarta filas incompletas y asigna ids a las nuevas."""
+    df = df.reindex(columns=REGLAS_COLUMNS)
+    for c in ("tag", "variable", "operador", "comparador", "prioridad", "asignado_a", "area"):
+        df[c] = df[c].astype(object).where(df[c].notna(), "").astype(str).str.strip()
+    df["limite"] = pd.to_numeric(df["limite"], errors="coerce")
+    df = df[(df["tag"] != "") & (df["variable"] != "") & df["limite"].notna()]
+    for spec in df["operador"]:
+        parse_operador(spec)   # ValueError con el detalle si no es válido
+    df["comparador"] = df["comparador"].where(df["comparador"].isin(REGLA_COMPARADORES), ">")
+    df["prioridad"] = df["prioridad"].where(df["prioridad"] != "", "P2")
+    df["activa"] = df["activa"].astype(object).where(df["activa"].notna(), True).astype(bool)
+    for c in ("banda_muerta", "retardo_on_s", "retardo_off_s"):
+        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0).clip(lower=0)
+    nuevas = df["id"].isna().to_numpy()
+    if nuevas.any():
+        df.loc[nuevas, "id"] = list(reserve_ids(F_REGLAS, int(nuevas.sum())))
+    save_csv(df, F_REGLAS)
+
+# =========================
+# Patrones de alarmas (CEP)
+# =========================
+# Secuencias temporales entre reglas, p. ej. "succión baja en K-301 y después
+# temperatura de carcasa alta dentro de 10 minutos" = pasos "2 -> 3", ventana 600 s.
+# Los eventos son las activaciones de alarma (ya con banda muerta, retardos y
+# supresión). Cada patrón se compila a un autómata secuencial: por patrón y paso
+# se guarda el inicio más reciente de una coincidencia parcial que espera ese paso
+# (el que más plazo deja), así que el estado es O(patrones × pasos) y nunca se
+# relee la historia. Un índice regla -> (patrón, paso) hace que cada evento toque
+# sólo los autómatas que lo escuchan, todos en una operación vectorizada.
+PATRONES_COLUMNS = ["id", "nombre", "pasos", "ventana_s", "prioridad", "asignado_a", "area", "activa"]
+
+def parse_patron(spec: str) -> list:
+    """"2 -> 3|4" -> [frozenset({2}), frozenset({3, 4})]; ValueError si no es válido."""
+    pasos = []
+    for paso in str(spec).split("->"):
+        try:
+            ids = frozenset(int(i) for i in paso.replace(" ", "").split("|"))
+        except ValueError:
+            raise ValueError(f"Paso inválido en {spec!r}: {paso.strip()!r} (ids de regla, alternativas con |)") from None
+        pasos.append(ids)
+    if len(pasos) < 2:
+        raise ValueError(f"Patrón {spec!r}: se necesitan al menos dos pasos separados por ->")
+    return pasos
+
+def compile_patterns(df: pd.DataFrame) -> dict:
+    """Patrones activos como autómatas: pasos, ventana (ms) y el índice regla -> (patrón, paso)."""
+    df = df.reindex(columns=PATRONES_COLUMNS)
+    df = df[df["activa"].fillna(False).astype(bool).to_numpy() & (df["ventana_s"].fillna(0) > 0).to_numpy()]
+    pasos, validos = [], []
+    for spec in df["pasos"].astype(object).fillna("").astype(str):
+        try:
+            pasos.append(parse_patron(spec))
+            validos.append(True)
+        except ValueError:   # editado a mano fuera de la app: se ignora ese patrón
+            validos.append(False)
+    df = df[np.array(validos, dtype=bool)]
+    texto = {c: df[c].astype(object).fillna("").astype(str).to_numpy(dtype=object)
+             for c in ("nombre", "prioridad", "asignado_a", "area")}
+    ventana = (df["ventana_s"].to_numpy(dtype="float64") * 1000).astype("int64")
+    n_pasos = np.array([len(ps) for ps in pasos], dtype="int64")
+    max_pasos = int(n_pasos.max()) if len(n_pasos) else 1
+    por_regla = {}
+    for p, ps in enumerate(pasos):
+        for i, ids in enumerate(ps):
+            for rid in ids:
+                por_regla.setdefault(rid, []).append((p, i))
+    # Por regla, todo lo que un evento necesita ya resuelto: celdas (patrón, paso) planas
+    # en la matriz de estado, ventana, y si el paso es el primero o el último.
+    oyentes = {}
+    for rid, ls in por_regla.items():
+        p, i = (np.array(v, dtype="int64") for v in zip(*ls))
+        fin = i + 1 == n_pasos[p]
+        oyentes[rid] = {"p": p, "celda": p * max_pasos + i, "sig": p * max_pasos + np.where(fin, i, i + 1),
+                        "ventana": ventana[p], "inicio": i == 0, "fin": fin}
+    return {
+        "id": df["id"].to_numpy(dtype="int64"), "nombre": texto["nombre"], "pasos": pasos,
+        "n_pasos": n_pasos, "max_pasos": max_pasos,
+        "ventana": ventana, "prioridad": np.where(texto["prioridad"] != "", texto["prioridad"], "P1"),
+        "asignado_a": np.where(texto["asignado_a"] != "", texto["asignado_a"], texto["area"]),
+        # Un cambio de pasos o ventana reinicia el autómata de ese patrón.
+        "firma": [(tuple(tuple(sorted(ids)) for ids in ps), int(v)) for ps, v in zip(pasos, ventana)],
+        "oyentes": oyentes,
+    }
+
+def compiled_patterns() -> dict:
+    """Patrones de la tabla compilados; se recompilan sólo cuando cambia su versión."""
+    return derived(F_PATRONES, "compilados", lambda: compile_patterns(load_csv(F_PATRONES)))
+
+class AutomatasPatrones:
+    """Estado de los autómatas de todos los patrones compilados."""
+
+    def __init__(self, patrones: dict, previo: "AutomatasPatrones" = None):
+        self.patrones = patrones
+        n, s = len(patrones["id"]), patrones["max_pasos"]
+        self.inicio = np.full((n, s), np.nan)               # [patrón, paso esperado] -> ts de inicio
+        self.rastro = np.full((n, s), None, dtype=object)   # eventos de esa coincidencia parcial
+        self.coincidencias = np.zeros(n, dtype="int64")
+        if previo is not None:
+            antes = {(pid, f): q for q, (pid, f) in enumerate(zip(previo.patrones["id"].tolist(),
+                                                                   previo.patrones["firma"]))}
+            for p, (pid, f) in enumerate(zip(patrones["id"].tolist(), patrones["firma"])):
+                q = antes.get((pid, f))
+                if q is not None:
+                    k = patrones["n_pasos"][p]
+                    self.inicio[p, :k] = previo.inicio[q, :k]
+                    self.rastro[p, :k] = previo.rastro[q, :k]
+                    self.coincidencias[p] = previo.coincidencias[q]
+
+    def avanzar(self, ts: int, rid: int, evento: tuple) -> list:
+        """Aplica un evento (activación de la regla `rid` en `ts`); devuelve [(patrón, eventos)] completados.
+
+        Todas las transiciones se calculan sobre el estado anterior al evento, así un
+        mismo evento no cubre dos pasos seguidos del mismo patrón.
+        """
+        o = self.patrones["oyentes"].get(rid)
+        if o is None:
+            return []
+        inicio, rastro = self.inicio.reshape(-1), self.rastro.reshape(-1)   # vistas planas
+        previo = inicio[o["celda"]]
+        vencido = ts - previo > o["ventana"]   # NaN (sin parcial) nunca vence
+        if vencido.any():
+            inicio[o["celda"][vencido]] = np.nan
+            rastro[o["celda"][vencido]] = None
+        ok = np.flatnonzero(o["inicio"] | (previo >= ts - o["ventana"]))
+        if not len(ok):
+            return []
+        desde = np.where(o["inicio"][ok], ts, previo[ok])
+        eventos = [(r or ()) + (evento,) for r in rastro[o["celda"][ok]].tolist()]
+        fin = o["fin"][ok]
+        # Avanza al paso siguiente si no había parcial o el nuevo empezó más tarde.
+        sig = o["sig"][ok]
+        for j in np.flatnonzero(~fin & ~(inicio[sig] > desde)).tolist():
+            inicio[sig[j]], rastro[sig[j]] = desde[j], eventos[j]
+        completos = np.flatnonzero(fin).tolist()
+        if not completos:
+            return []
+        hechos = o["p"][ok][completos]
+        self.inicio[hechos] = np.nan
+        self.rastro[hechos] = None
+        self.coincidencias[hechos] += 1
+        return [(int(p), eventos[j]) for p, j in zip(hechos.tolist(), completos)]
+
+    def estado_df(self, ahora: int = None) -> pd.DataFrame:
+        """Por patrón: paso más avanzado con una coincidencia parcial vigente y desde cuándo."""
+        pat = self.patrones
+        vigente = ~np.isnan(self.inicio)
+        if ahora is not None:
+            vigente &= ahora - np.nan_to_num(self.inicio) <= pat["ventana"][:, None]
+        paso = np.where(vigente.any(axis=1), self.inicio.shape[1] - 1 - np.argmax(vigente[:, ::-1], axis=1), 0)
+        desde = self.inicio[np.arange(len(paso)), paso]
+        df = pd.DataFrame({
+            "patrón": pat["id"], "nombre": pat["nombre"],
+            "pasos": [" -> ".join("|".join(map(str, sorted(ids))) for ids in ps) for ps in pat["pasos"]],
+            "ventana [s]": pat["ventana"] / 1000,
+            "esperando paso": paso + 1, "coincidencias": self.coincidencias,
+        })
+        df["desde"] = pd.to_datetime(pd.Series(np.where(paso > 0, desde, np.nan)), unit="ms", utc=True)
+        return df
+
+def _titulo_patron(patrones: dict, p: int) -> str:
+    return f"Patrón {patrones['id'][p]}: {patrones['nombre'][p]}"
+
+def guardar_patrones(df: pd.DataFrame):
+    """Reemplaza la tabla de patrones; valida los pasos contra las reglas existentes y asigna ids a los nuevos."""
+    df = df.reindex(columns=PATRONES_COLUMNS)
+    for c in ("nombre", "pasos", "prioridad", "asignado_a", "area"):
+        df[c] = df[c].astype(object).where(df[c].notna(), "").astype(str).str.strip()
+    df["ventana_s"] = pd.to_numeric(df["ventana_s"], errors="coerce")
+    df = df[(df["pasos"] != "") & df["ventana_s"].notna()]
+    reglas = set(pd.to_numeric(load_csv(F_REGLAS)["id"], errors="coerce").dropna().astype(int).tolist())
+    for nombre, spec in zip(df["nombre"], df["pasos"]):
+        faltan = sorted(set().union(*parse_patron(spec)) - reglas)
+        if faltan:
+            raise ValueError(f"Patrón {nombre or spec!r}: no existe la regla {', '.join(map(str, faltan))}")
+    if (df["ventana_s"] <= 0).any():
+        raise ValueError("La ventana de un patrón debe ser mayor que 0 s")
+    df["nombre"] = df["nombre"].where(df["nombre"] != "", df["pasos"])
+    df["prioridad"] = df["prioridad"].where(df["prioridad"] != "", "P1")
+    df["activa"] = df["activa"].astype(object).where(df["activa"].notna(), True).astype(bool)
+    nuevas = df["id"].isna().to_numpy()
+    if nuevas.any():
+        df.loc[nuevas, "id"] = list(reserve_ids(F_PATRONES, int(nuevas.sum())))
+    save_csv(df, F_PATRONES)
+
+# =========================
+# Ingesta IoT (asyncio)
+# =========================
+# Un hilo por proceso corre un event loop que recibe lecturas en protocolo de
+# líneas "tag,variable,valor[,ts_ms]" por UDP (IOT_UDP) y/o siguiendo un archivo
+# como `tail -f` (IOT_TAIL). Los bytes sólo se acumulan; cada IOT_BATCH_MS el lote
+# completo se parsea con el parser C de pandas, se actualiza la última lectura por
+# (tag, variable) y las reglas se evalúan en bloque. Las notificaciones de un lote
+# van al escritor en un único insert.
+IOT_COLUMNS = ["tag", "variable", "valor", "ts"]
+IOT_UDP_RCVBUF = 8 * 1024 * 1024
+
+def parse_lecturas(buf: bytes) -> pd.DataFrame:
+    """Lote de líneas "tag,variable,valor[,ts_ms]"; sin ts se usa la hora de llegada, las inválidas se descartan."""
+    if not buf.strip():
+        return pd.DataFrame({"tag": pd.Series(dtype="category"), "variable": pd.Series(dtype="category"),
+                             "valor": pd.Series(dtype="float64"), "ts": pd.Series(dtype="int64")})
+    df = pd.read_csv(io.BytesIO(buf), header=None, names=IOT_COLUMNS, engine="c",
+                     dtype={"tag": "category", "variable": "category"}, on_bad_lines="skip",
+                     skip_blank_lines=True)
+    valor = pd.to_numeric(df["valor"], errors="coerce")
+    ts = pd.to_numeric(df["ts"], errors="coerce").fillna(now_ms()).astype("int64")
+    out = df.assign(valor=valor.astype("float64"), ts=ts)
+    return out[valor.notna().to_numpy() & out["tag"].notna().to_numpy()]
+
+class _LineDatagram(asyncio.DatagramProtocol):
+    def __init__(self, service: "IngestService"):
+        self.service = service
+
+    def datagram_received(self, data: bytes, addr):
+        self.service.feed(data if data.endswith(b"\n") else data + b"\n")
+
+class IngestService:
+    """Recepción asíncrona + evaluación por micro-lotes de lecturas IoT."""
+
+    def __init__(self, udp: str = "", tail: str = "", reglas=None, patrones=None):
+        self.udp, self.tail = udp, tail
+        self.reglas = reglas or compiled_rules  # proveedor de reglas compiladas
+        self.patrones = patrones or compiled_patterns
+        self.automatas = None                   # AutomatasPatrones de los patrones vigentes
+        self.udp_addr = None                    # (host, puerto) efectivamente abierto
+        self._pending = []                      # bytes recibidos desde el último lote
+        self._pending_lock = threading.Lock()
+        self._eval_lock = threading.Lock()      # un lote a la vez (hilo del loop o botón de la UI)
+        self.ultimas = {}                       # (tag, variable) -> (valor, ts)
+        self.alarmas = {}                       # id de regla -> estado de la alarma
+        self.cadenas = {}                       # id de regla -> Cadena de operadores de ventana
+        self.suprimidas = {}                    # id de regla -> suprimida hasta (epoch ms)
+        self.stats = {"lecturas": 0, "descartadas": 0, "lotes": 0, "notificaciones": 0,
+                      "actualizadas": 0, "correlaciones": 0, "lecturas/s": 0.0, "error": ""}
+        self._t_lote = time.monotonic()
+        self._thread = None
+        self._ready = threading.Event()
+        self._loop = self._task = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="iot-ingest")
+            self._thread.start()
+            self._ready.wait(5)
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+            self._thread.join(5)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self._main())
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    def feed(self, data: bytes):
+        with self._pending_lock:
+            self._pending.append(data)
+
+    def _take(self) -> bytes:
+        with self._pending_lock:
+            data, self._pending = self._pending, []
+        return b"".join(data)
+
+    def process(self, data: bytes, detalle: bool = False):
+        """Parsea y evalúa un lote de líneas; devuelve los ids de las notificaciones creadas.
+
+        Con `detalle` devuelve (ids, ids de las reglas que se cumplieron en el lote), para
+        distinguir una lectura sin alarma de una alarma ya activa, suprimida o en retardo.
+        """
+        lote = parse_lecturas(data)
+        with self._eval_lock:
+            now = time.monotonic()
+            self.stats["lotes"] += 1
+            self.stats["lecturas"] += len(lote)
+            self.stats["descartadas"] += max(data.count(b"\n") - len(lote), 0)
+            self.stats["lecturas/s"] = round(len(lote) / max(now - self._t_lote, 1e-3), 1)
+            self._t_lote = now
+            if lote.empty:
+                return ([], []) if detalle else []
+            last = lote.drop_duplicates(["tag", "variable"], keep="last")
+            self.ultimas.update(zip(zip(last["tag"].astype(str), last["variable"].astype(str)),
+                                    zip(last["valor"].tolist(), last["ts"].tolist())))
+            nuevas, cambios, eventos, cumplidas = self.evaluate(lote)
+            # Ids reservados antes de escribir, para que cada paso de un patrón lleve el de su
+            # notificación y todo el lote vaya al escritor en un solo commit.
+            for (alarma, row), new_id in zip(nuevas, reserve_ids(F_NOTIF, len(nuevas)) if nuevas else []):
+                row["id"] = alarma["notif"] = new_id
+            rows = [row for _, row in nuevas]
+            if eventos:
+                correlacionadas, cambios_cep = self.correlate(eventos)
+                rows += correlacionadas
+                cambios += cambios_cep
+                self.stats["correlaciones"] += len(correlacionadas)
+            ids, _ = write_rows(F_NOTIF, rows, cambios) if rows or cambios else ([], [])
+            self.stats["notificaciones"] += len(ids)
+            self.stats["actualizadas"] += len(cambios)
+            return (ids, cumplidas) if detalle else ids
+
+    def evaluate(self, lote: pd.DataFrame) -> tuple:
+        """Transiciones de alarma del lote: ([(alarma, notificación nueva)], [(id, cambios)], [activaciones], [ids cumplidos]).
+
+        Cada regla (un tag) tiene su máquina de estados: se activa si se cumple durante
+        `retardo_on_s`, se normaliza si la lectura sale de la banda muerta durante
+        `retardo_off_s`, y mientras está suprimida no se evalúa. Si al activarse ya hay
+        una notificación abierta, o si empeora estando activa, se actualiza esa misma.
+        Cada activación, (ts, id de regla, alarma), es un evento para los patrones. Los ids
+        cumplidos son las reglas que se cumplen en el lote (con su operador de ventana),
+        estén o no suprimidas.
+        """
+        reglas = self.reglas()
+        pares = aplicar_operadores(evaluar_reglas(lote, reglas), reglas, self.cadenas)
+        if pares.empty:
+            return [], [], [], []
+        tramos = corridas_reglas(pares, reglas)
+        # Sólo pueden cambiar de estado las reglas que se cumplen en este lote o cuya
+        # alarma está activa o esperando un retardo; el resto ni entra al bucle.
+        vivas = [rid for rid, a in list(self.alarmas.items()) if a["activa"] or a["desde"] is not None]
+        regla = tramos["regla"].to_numpy()
+        cumplen = np.unique(regla[tramos["clase"].to_numpy() == 1])
+        cumplidas = [int(r) for r in reglas["id"][cumplen]]
+        utiles = np.isin(regla, cumplen) | np.isin(reglas["id"][regla], vivas)
+        tramos = tramos[utiles]
+        if tramos.empty:
+            return [], [], [], cumplidas
+        ahora = now_ms()
+        activadas, peores = {}, {}   # posición de la regla -> estado de su alarma
+        eventos = []
+        for k, clase, desde, hasta, pico in zip(*(tramos[c].tolist() for c in
+                                                  ("regla", "clase", "desde", "hasta", "pico"))):
+            rid = int(reglas["id"][k])
+            if self.suprimidas.get(rid, 0) > ahora:
+                continue
+            a = self.alarmas.get(rid)
+            if a is None:
+                a = self.alarmas[rid] = {"activa": False, "desde": None, "notif": None, "pico": 0.0,
+                                         "tag": reglas["tag"][k], "titulo": _titulo_regla(reglas, k)}
+            if a["activa"]:
+                if clase == -1:
+                    ini = desde if a["desde"] is None else a["desde"]
+                    if hasta - ini >= reglas["retardo_off"][k]:
+                        a.update(activa=False, desde=None)
+                    else:
+                        a["desde"] = ini
+                else:
+                    a["desde"] = None
+                    if clase == 1 and pico > a["pico"]:
+                        a["pico"] = pico
+                        peores[k] = a
+            elif clase == 1:
+                ini = desde if a["desde"] is None else a["desde"]
+                if hasta - ini >= reglas["retardo_on"][k]:
+                    a.update(activa=True, desde=None, pico=pico, titulo=_titulo_regla(reglas, k))
+                    activadas[k] = a
+                    eventos.append((max(desde, ini + int(reglas["retardo_on"][k])), rid, a))
+                else:
+                    a["desde"] = ini
+            else:
+                a["desde"] = None
+
+        nuevas, cambios = [], []
+        ts_lote = int(tramos["hasta"].max())
+        abiertas = _notif_abiertas(list({a["tag"] for a in activadas.values()})) if activadas else {}
+        for k, a in activadas.items():
+            valor = _valor_pico(reglas, k, a["pico"])
+            if a["notif"] is None or not notif_abierta(a["notif"]):
+                a["notif"] = abiertas.get(a["titulo"])
+            if a["notif"] is not None:
+                cambios.append((a["notif"], {"motivo": f"{_medida(reglas, k)}={valor:g} (reactivada)"}))
+                continue
+            nuevas.append((a, {
+                "ts_creacion": now_ms(), "tag": reglas["tag"][k], "titulo": a["titulo"],
+                "motivo": f"{_medida(reglas, k)}={valor:g} (lectura {fmt_ms(ts_lote)})",
+                "prioridad": reglas["prioridad"][k],
+                "estado": "Pendiente", "asignado_a": reglas["asignado_a"][k], "ts_recibida": "",
+                "ts_cerrada": "", "evidencia": "Evento IoT",
+            }))
+        for k, a in peores.items():
+            if k not in activadas and a["notif"] is not None and notif_abierta(a["notif"]):
+                valor = _valor_pico(reglas, k, a["pico"])
+                cambios.append((a["notif"], {"motivo": f"{_medida(reglas, k)}={valor:g} (pico)"}))
+        return nuevas, cambios, eventos, cumplidas
+
+    def correlate(self, eventos: list) -> tuple:
+        """Pasa las activaciones por los autómatas de patrones, en orden de ts.
+
+        Devuelve ([notificación correlacionada nueva], [(id, cambios)]): una por patrón
+        completado, o una actualización si la de ese patrón sigue abierta.
+        """
+        patrones = self.patrones()
+        if self.automatas is None or self.automatas.patrones is not patrones:
+            self.automatas = AutomatasPatrones(patrones, previo=self.automatas)
+        completos = []
+        for ts, rid, a in sorted(eventos, key=lambda e: e[0]):
+            evento = (ts, rid, a["tag"], a["notif"])
+            completos += self.automatas.avanzar(ts, rid, evento)
+        if not completos:
+            return [], []
+        nuevas, cambios = [], []
+        abiertas = _notif_abiertas(list({ev[0][2] for _, ev in completos}))
+        for p, ev in completos:
+            titulo = _titulo_patron(patrones, p)
+            motivo = (" -> ".join(f"regla {rid}" + (f" (#{notif})" if notif is not None else "")
+                                  for _, rid, _, notif in ev)
+                      + f" en {(ev[-1][0] - ev[0][0]) / 60_000:.1f} min")
+            if titulo in abiertas:
+                cambios.append((abiertas[titulo], {"motivo": f"{motivo} (repetido)"}))
+                continue
+            abiertas[titulo] = None   # un mismo lote no crea dos del mismo patrón
+            nuevas.append({
+                "ts_creacion": now_ms(), "tag": ev[0][2], "titulo": titulo,
+                "motivo": f"{motivo} (último paso {fmt_ms(ev[-1][0])})",
+                "prioridad": patrones["prioridad"][p], "estado": "Pendiente",
+                "asignado_a": patrones["asignado_a"][p], "ts_recibida": "", "ts_cerrada": "",
+                "evidencia": "Patrón IoT",
+            })
+        return nuevas, [c for c in cambios if c[0] is not None]
+
+    def patrones_df(self) -> pd.DataFrame:
+        with self._eval_lock:
+            patrones = self.patrones()
+            if self.automatas is None or self.automatas.patrones is not patrones:
+                self.automatas = AutomatasPatrones(patrones, previo=self.automatas)
+            return self.automatas.estado_df(now_ms())
+
+    def suprimir(self, regla_id: int, minutos: float):
+        """Shelving: la regla no se evalúa hasta que vence el plazo."""
+        self.suprimidas[int(regla_id)] = now_ms() + int(minutos * 60_000)
+
+    def reactivar(self, regla_id: int):
+        self.suprimidas.pop(int(regla_id), None)
+
+    def alarmas_df(self) -> pd.DataFrame:
+        ahora = now_ms()
+        rows = [{"regla": rid, "tag": a["tag"], "estado": "Activa" if a["activa"] else
+                 ("Esperando retardo" if a["desde"] is not None else "Normal"),
+                 "notificación": a["notif"], "suprimida hasta": self.suprimidas.get(rid)}
+                for rid, a in list(self.alarmas.items())]
+        reglas = self.reglas()
+        tags = dict(zip(reglas["id"].tolist(), reglas["tag"]))
+        rows += [{"regla": rid, "tag": tags.get(rid, ""), "estado": "Normal", "notificación": None,
+                  "suprimida hasta": hasta}
+                 for rid, hasta in list(self.suprimidas.items()) if rid not in self.alarmas]
+        df = pd.DataFrame(rows, columns=["regla", "tag", "estado", "notificación", "suprimida hasta"])
+        df["notificación"] = df["notificación"].astype("Int64")
+        vigente = df["suprimida hasta"].notna() & (df["suprimida hasta"].fillna(0) > ahora)
+        df["suprimida hasta"] = pd.to_datetime(df["suprimida hasta"].where(vigente), unit="ms", utc=True)
+        return df.sort_values("regla")
+
+    def ultimas_df(self) -> pd.DataFrame:
+        rows = [(t, v, val, ts) for (t, v), (val, ts) in list(self.ultimas.items())]
+        df = pd.DataFrame(rows, columns=IOT_COLUMNS)
+        df["ts"] = pd.to_datetime(df["ts"], unit="ms", utc=True)
+        return df.sort_values("ts", ascending=False)
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        transport = None
+        if self.udp:
+            try:
+                host, port = self.udp.rsplit(":", 1)
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, IOT_UDP_RCVBUF)
+                sock.bind((host, int(port)))
+                self.udp_addr = sock.getsockname()
+                transport, _ = await loop.create_datagram_endpoint(lambda: _LineDatagram(self), sock=sock)
+            except OSError as e:
+                self.stats["error"] = f"UDP {self.udp}: {e}"
+        self._ready.set()
+        tasks = [self._batcher()]
+        if self.tail:
+            tasks.append(self._tail(Path(self.tail)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            if transport is not None:
+                transport.close()
+
+    async def _batcher(self):
+        while True:
+            await asyncio.sleep(IOT_BATCH_MS / 1000)
+            data = self._take()
+            if not data:
+                continue
+            try:
+                # Fuera del loop: parsear y escribir no frena la recepción.
+                await asyncio.to_thread(self.process, data)
+            except Exception as e:
+                self.stats["error"] = f"lote: {e}"
+
+    async def _tail(self, path: Path):
+        pos = path.stat().st_size if path.exists() else 0   # como tail -f: desde el final
+        resto = b""
+        while True:
+            await asyncio.sleep(IOT_BATCH_MS / 1000)
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                continue
+            if size < pos:   # truncado o rotado
+                pos, resto = 0, b""
+            if size == pos:
+                continue
+            with open(path, "rb") as fh:
+                fh.seek(pos)
+                chunk = fh.read(size - pos)
+            pos += len(chunk)
+            chunk = resto + chunk
+            cut = chunk.rfind(b"\n") + 1
+            resto = chunk[cut:]
+            if cut:
+                self.feed(chunk[:cut])
+
+@st.cache_resource(show_spinner=False)
+def iot_service() -> IngestService:
+    service = IngestService(udp=IOT_UDP, tail=IOT_TAIL)
+    service.start()
+    return service
+
+def bench_iot_ingest(n: int = 500_000, tags: int = 5_000, lote: int = 10_000) -> pd.DataFrame:
+    """Lecturas/s de parseo + evaluación por micro-lotes, y de punta a punta por UDP local."""
+    rng = np.random.default_rng(0)
+    nombres = np.array([f"BENCH-{i}" for i in range(tags)], dtype=object)
+    lineas = [f"{t},Presión,{v:.2f}\n".encode() for t, v in zip(nombres[rng.integers(0, tags, n)], rng.normal(5, 1, n))]
+    rows = []
+    # Una regla por tag del benchmark, con límites que no se alcanzan: se evalúa todo sin escribir.
+    base = pd.DataFrame({"id": np.arange(tags), "tag": nombres, "variable": "Presión", "comparador": ">",
+                         "limite": 1e9, "prioridad": "P3", "asignado_a": "", "area": "", "activa": True})
+    for operador in ("", "media:300"):
+        reglas = compile_rules(base.assign(operador=operador))
+        service = IngestService(reglas=lambda: reglas)   # sin iniciar: sólo el camino de evaluación
+        t0 = time.perf_counter()
+        for i in range(0, n, lote):
+            service.process(b"".join(lineas[i:i + lote]))
+        dt = time.perf_counter() - t0
+        rows.append({"camino": f"parseo + reglas {operador or 'umbral'} (lotes de {lote})", "lecturas": n,
+                     "s": round(dt, 3), "lecturas/s": round(n / dt), "perdidas": 0})
+    reglas = compile_rules(base.assign(operador=""))
+    # Punta a punta con un servicio propio en un puerto libre, para no mezclar con las lecturas reales.
+    service = IngestService(udp="127.0.0.1:0", reglas=lambda: reglas)
+    service.start()
+    if service.udp_addr is not None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        t0 = time.perf_counter()
+        for j, i in enumerate(range(0, n, 40)):   # ~40 líneas por datagrama (< 1 KB)
+            sock.sendto(b"".join(lineas[i:i + 40]), service.udp_addr)
+            if j % 50 == 49:
+                time.sleep(0.001)   # emisor con ritmo, sin desbordar el buffer del socket
+        sock.close()
+        visto, quieto = -1, 0
+        while service.stats["lecturas"] < n and quieto < 3:
+            time.sleep(IOT_BATCH_MS / 1000)
+            quieto = quieto + 1 if service.stats["lecturas"] == visto else 0
+            visto = service.stats["lecturas"]
+        dt = time.perf_counter() - t0
+        recibidas = service.stats["lecturas"]
+        service.stop()
+        rows.append({"camino": "UDP local de punta a punta", "lecturas": recibidas, "s": round(dt, 3),
+                     "lecturas/s": round(recibidas / dt), "perdidas": n - recibidas})
+    return pd.DataFrame(rows)
+
+def bench_cep(patrones: int = 500, eventos: int = 100_000) -> pd.DataFrame:
+    """Eventos/s por los autómatas de `patrones` patrones de 3 pasos, con pocas y muchas reglas compartidas."""
+    rng = np.random.default_rng(0)
+    rows = []
+    for reglas in (1_000, 20):   # ~1.5 y ~75 autómatas por evento
+        df = pd.DataFrame({"id": np.arange(1, patrones + 1), "nombre": "bench",
+                           "pasos": [" -> ".join(map(str, rng.integers(0, reglas, 3))) for _ in range(patrones)],
+                           "ventana_s": 600, "prioridad": "P3", "asignado_a": "", "area": "", "activa": True})
+        automatas = AutomatasPatrones(compile_patterns(df))
+        rid = rng.integers(0, reglas, eventos).tolist()
+        ts = np.cumsum(rng.integers(0, 2_000, eventos)).tolist()
+        t0 = time.perf_counter()
+        completos = sum(len(automatas.avanzar(t, r, (t, r, "", None))) for t, r in zip(ts, rid))
+        dt = time.perf_counter() - t0
+        rows.append({"patrones": patrones, "reglas": reglas, "eventos": eventos, "coincidencias": completos,
+                     "s": round(dt, 3), "eventos/s": round(eventos / dt)})
+    return pd.DataFrame(rows)
+
 # =========================
 # Seed de datos si no existen
 # =========================
 def seed_if_missing():
-    if not F_USUARIOS.exists():
+    if not table_exists(F_USUARIOS):
         usuarios = pd.DataFrame([
             {"user_id": "op1", "nombre": "Operario 1", "rol": "Operario",   "area": "Operación Área B"},
             {"user_id": "op2", "nombre": "Operario 2", "rol": "Operario",   "area": "Operación Área A"},
@@ -80,7 +2862,7 @@ def seed_if_missing():
         ])
         save_csv(usuarios, F_USUARIOS)
 
-    if not F_ACTIVOS.exists():
+    if not table_exists(F_ACTIVOS):
         activos = pd.DataFrame([
             {"tag": "V-210",   "descripcion": "Válvula de control línea de producción", "area": "Área B"},
             {"tag": "P-101",   "descripcion": "Bomba de transferencia",                 "area": "Área A"},
@@ -89,18 +2871,18 @@ def seed_if_missing():
         ])
         save_csv(activos, F_ACTIVOS)
 
-    if not F_NOTIF.exists():
+    if not table_exists(F_NOTIF):
         notif = pd.DataFrame([
-            {"id": 1, "ts_creacion": now_iso(), "tag": "V-210", "titulo": "Chequear válvula V-210",
+            {"id": 1, "ts_creacion": now_ms(), "tag": "V-210", "titulo": "Chequear válvula V-210",
              "motivo": "Sobrepresión", "prioridad": "P1", "estado": "Pendiente",
              "asignado_a": "Operario 1", "ts_recibida": "", "ts_cerrada": "", "evidencia": ""},
-            {"id": 2, "ts_creacion": now_iso(), "tag": "P-101", "titulo": "Verificar sello mecánico",
+            {"id": 2, "ts_creacion": now_ms(), "tag": "P-101", "titulo": "Verificar sello mecánico",
              "motivo": "Goteo observado", "prioridad": "P2", "estado": "Pendiente",
              "asignado_a": "Operario 2", "ts_recibida": "", "ts_cerrada": "", "evidencia": ""},
         ])
         save_csv(notif, F_NOTIF)
 
-    if not F_RONDAS_PLT.exists():
+    if not table_exists(F_RONDAS_PLT):
         rondas = pd.DataFrame([
             {"plantilla": "Ronda Compresores", "tag": "K-301",   "variable": "Presión succión [bar]",      "lim_inf": 2.0,  "lim_sup": 5.0},
             {"plantilla": "Ronda Compresores", "tag": "K-301",   "variable": "Temperatura carcasa [°C]",   "lim_inf": 20.0, "lim_sup": 80.0},
@@ -109,36 +2891,110 @@ def seed_if_missing():
         ])
         save_csv(rondas, F_RONDAS_PLT)
 
-    if not F_RONDAS_RUN.exists():
+    if not table_exists(F_RONDAS_RUN):
         save_csv(pd.DataFrame(columns=["id","ts","plantilla","tag","variable","valor","en_rango","operario"]), F_RONDAS_RUN)
 
-    if not F_INCIDENTES.exists():
+    if not table_exists(F_INCIDENTES):
         inc = pd.DataFrame([
-            {"id": 1, "ts": now_iso(), "tag": "V-210", "titulo": "Near Miss por sobrepresión",
+            {"id": 1, "ts": now_ms(), "tag": "V-210", "titulo": "Near Miss por sobrepresión",
              "severidad": "Medio", "descripcion": "Se detecta lectura por encima del umbral",
              "reportado_por": "Operario 1", "estado": "Abierto"},
         ])
         save_csv(inc, F_INCIDENTES)
 
-    if not F_PTWOT.exists():
+    if not table_exists(F_PTWOT):
         ptw = pd.DataFrame([
-            {"id": 1, "ts_solicitud": now_iso(), "tipo": "Trabajo caliente", "solicitante": "Supervisor 1",
+            {"id": 1, "ts_solicitud": now_ms(), "tipo": "Trabajo caliente", "solicitante": "Supervisor 1",
              "area": "Área B", "estado": "Borrador", "aprob_hse": "No", "ts_cierre": "", "adjuntos": ""},
         ])
         save_csv(ptw, F_PTWOT)
 
+    if not table_exists(F_REGLAS):
+        reglas = pd.DataFrame([
+            {"id": 1, "tag": "V-210",   "variable": "Presión",                  "comparador": ">",  "limite": 8.0,
+             "prioridad": "P1", "asignado_a": "Operario 1", "area": "Área B",     "activa": True,
+             "banda_muerta": 0.5, "retardo_on_s": 0, "retardo_off_s": 10},
+            {"id": 2, "tag": "K-301",   "variable": "Presión succión [bar]",    "comparador": "<",  "limite": 2.0,
+             "prioridad": "P2", "asignado_a": "",           "area": "Compresión", "activa": True,
+             "banda_muerta": 0.2, "retardo_on_s": 5, "retardo_off_s": 30},
+            {"id": 3, "tag": "K-301",   "variable": "Temperatura carcasa [°C]", "comparador": ">",  "limite": 80.0,
+             "prioridad": "P2", "asignado_a": "",           "area": "Compresión", "activa": True,
+             "banda_muerta": 2.0, "retardo_on_s": 5, "retardo_off_s": 30},
+            {"id": 4, "tag": "TK-1203", "variable": "Nivel [%]",                "comparador": ">=", "limite": 85.0,
+             "prioridad": "P1", "asignado_a": "Operario 2", "area": "Tanques",    "activa": True,
+             "banda_muerta": 1.0, "retardo_on_s": 0, "retardo_off_s": 60},
+            # Con operador de ventana: subida de más de 0.5 bar/min y media de 5 minutos.
+            {"id": 5, "tag": "V-210",   "variable": "Presión", "operador": "tasa:60",   "comparador": ">",
+             "limite": 0.5, "prioridad": "P2", "asignado_a": "Operario 1", "area": "Área B", "activa": True,
+             "banda_muerta": 0.1, "retardo_on_s": 0, "retardo_off_s": 30},
+            {"id": 6, "tag": "K-301",   "variable": "Temperatura carcasa [°C]", "operador": "media:300",
+             "comparador": ">", "limite": 75.0, "prioridad": "P2", "asignado_a": "", "area": "Compresión",
+             "activa": True, "banda_muerta": 1.0, "retardo_on_s": 0, "retardo_off_s": 60},
+        ])
+        save_csv(reglas, F_REGLAS)
+
+    if not table_exists(F_PATRONES):
+        patrones = pd.DataFrame([
+            {"id": 1, "nombre": "K-301: succión baja y luego temperatura de carcasa alta", "pasos": "2 -> 3",
+             "ventana_s": 600, "prioridad": "P1", "asignado_a": "", "area": "Compresión", "activa": True},
+        ])
+        save_csv(patrones, F_PATRONES)
+
+if STORAGE_MODE == "sqlite":
+    migrate_csv_to_sqlite()
+if RONDAS_STORE == "parquet":
+    migrate_rondas_to_parquet()
 seed_if_missing()
+_timestamps_migrated()
+iot_service()
 
 # =========================
 # Carga de datos (cache)
 # =========================
-usuarios   = load_csv(F_USUARIOS)
-activos    = load_csv(F_ACTIVOS)
-notifs     = load_csv(F_NOTIF)
-rondas_plt = load_csv(F_RONDAS_PLT)
-rondas_run = load_csv(F_RONDAS_RUN)
-incidentes = load_csv(F_INCIDENTES)
-ptwot      = load_csv(F_PTWOT)
+# Cada página declara las tablas y columnas que usa (None = todas); sólo se
+# cargan ésas. Las ejecuciones de rondas se leen aparte (read_rondas_run).
+PAGE_TABLES = {
+    "Inicio":         {},
+    "Notificaciones": {"activos": (F_ACTIVOS, ["tag"]),
+                       "usuarios": (F_USUARIOS, ["nombre"])},
+    "Rondas":         {"rondas_plt": (F_RONDAS_PLT, None), "usuarios": (F_USUARIOS, ["nombre"])},
+    "PTW / OT":       {"activos": (F_ACTIVOS, ["area"]),
+                       "usuarios": (F_USUARIOS, ["nombre"])},
+    "Incidentes":     {"activos": (F_ACTIVOS, ["tag"]),
+                       "usuarios": (F_USUARIOS, ["nombre"])},
+    "Dashboard":      {},
+    "Documentos":     {},
+    "Config & IoT":   {"usuarios": (F_USUARIOS, None), "activos": (F_ACTIVOS, ["tag", "area"]),
+                       "reglas": (F_REGLAS, None), "patrones": (F_PATRONES, None)},
+}
+ALL_TABLES = {
+    "usuarios": F_USUARIOS, "activos": F_ACTIVOS, "notifs": F_NOTIF, "rondas_plt": F_RONDAS_PLT,
+    "rondas_run": F_RONDAS_RUN, "incidentes": F_INCIDENTES, "ptwot": F_PTWOT, "reglas": F_REGLAS,
+    "patrones": F_PATRONES,
+}
+
+def load_page_tables(page: str) -> dict:
+    if EAGER_LOAD:
+        return {name: load_csv(path) for name, path in ALL_TABLES.items()}
+    return {name: load_csv(path, columns=cols) for name, (path, cols) in PAGE_TABLES[page].items()}
+
+@st.cache_resource(show_spinner=False)
+def _page_timings() -> dict:
+    return {}
+
+def record_page_timing(page: str, ms: float):
+    samples = _page_timings().setdefault(page, [])
+    samples.append(ms)
+    del samples[:-200]
+
+def page_timing_stats() -> pd.DataFrame:
+    rows = []
+    for pg, samples in _page_timings().items():
+        arr = np.array(samples)
+        rows.append({"página": pg, "n": len(arr), "ms último": round(arr[-1], 1),
+                     "ms mediana": round(float(np.median(arr)), 1),
+                     "ms p95": round(float(np.percentile(arr, 95)), 1)})
+    return pd.DataFrame(rows, columns=["página", "n", "ms último", "ms mediana", "ms p95"])
 
 # =========================
 # Helpers visuales
@@ -159,6 +3015,81 @@ def chip_prioridad(p: str) -> str:
     pal = {"P1":"🔴 P1","P2":"🟠 P2","P3":"🟡 P3","P4":"🟢 P4"}
     return pal.get(p, p)
 
+def fmt_chips(df: pd.DataFrame, chips: dict) -> pd.DataFrame:
+    """Chips de estado/prioridad: la etiqueta se calcula una vez por categoría, no por fila."""
+    cols = {}
+    for c, label in chips.items():
+        if c not in df.columns:
+            continue
+        s = df[c] if isinstance(df[c].dtype, pd.CategoricalDtype) else df[c].astype("category")
+        cols[c] = s.cat.rename_categories([label(v) for v in s.cat.categories])
+    return df.assign(**cols) if cols else df
+
+def fmt_fechas(df: pd.DataFrame) -> pd.DataFrame:
+    """Fechas en la zona de planta como texto; se aplica sólo a las filas que se muestran."""
+    cols = {c: df[c].dt.tz_convert(APP_TZ).dt.strftime(TS_FORMAT).fillna("")
+            for c in df.columns if isinstance(df[c].dtype, pd.DatetimeTZDtype)}
+    return df.assign(**cols) if cols else df
+
+BANDEJA_PAGE_SIZE = 50
+
+def render_bandeja(path: Path, sort_col: str, key: str, chips: dict = None, empty_msg: str = "Sin registros.",
+                   filtro: dict = None):
+    """Bandeja paginada: sólo la página visible se arma y se envía al navegador.
+
+    Sin filtro el total sale de los contadores materializados, no de contar la tabla.
+    """
+    filtro = normalize_filter(filtro)
+    if filtro:
+        pos = filter_positions(path, filtro, sort_col)
+        total = len(pos)
+    else:
+        total = table_rows(path)
+    if total == 0:
+        st.info("Ningún registro cumple el filtro." if filtro else empty_msg)
+        return
+    n_pages = max(1, -(-total // BANDEJA_PAGE_SIZE))
+    # La página vuelve a 1 cuando cambia el filtro.
+    page_key = f"{key}_pagina_{json.dumps(filtro, sort_keys=True)}"
+    c1, c2 = st.columns([1, 4], vertical_alignment="bottom")
+    with c1:
+        pagina = st.number_input("Página", min_value=1, max_value=n_pages, value=1, step=1, key=page_key)
+    with c2:
+        st.caption(f"{total} registros • página {pagina} de {n_pages}")
+    offset = (pagina - 1) * BANDEJA_PAGE_SIZE
+    if filtro:
+        df = _cached_table(path).iloc[pos[offset:offset + BANDEJA_PAGE_SIZE]]
+    else:
+        df = read_window(path, sort_col, offset, BANDEJA_PAGE_SIZE)
+    st.dataframe(fmt_chips(fmt_fechas(df), chips or {}), use_container_width=True)
+
+def filter_bar(key: str, estados: list, prioridades: list, tags: list, personas: list,
+               prioridad_label: str = "Prioridad", persona_label: str = "Asignado a") -> dict:
+    """Barra de filtros de una bandeja; devuelve el filtro (ver compile_filter)."""
+    def _mis_p1():
+        st.session_state[f"{key}_estado"] = ["Pendiente"]
+        st.session_state[f"{key}_prioridad"] = ["P1"]
+        st.session_state[f"{key}_persona"] = [st.session_state[f"{key}_yo"]]
+        st.session_state[f"{key}_tag"] = []
+        st.session_state[f"{key}_texto"] = ""
+    with st.expander("🔎 Filtros"):
+        c1, c2, c3, c4 = st.columns(4)
+        estado = c1.multiselect("Estado", estados, key=f"{key}_estado")
+        prioridad = c2.multiselect(prioridad_label, prioridades, key=f"{key}_prioridad")
+        tag = c3.multiselect("Tag", tags, key=f"{key}_tag")
+        persona = c4.multiselect(persona_label, personas, key=f"{key}_persona")
+        c5, c6, c7 = st.columns([2, 2, 1], vertical_alignment="bottom")
+        rango = c5.date_input("Rango de fechas", value=(), key=f"{key}_rango")
+        texto = c6.text_input("Texto", key=f"{key}_texto")
+        if "Pendiente" in estados and "P1" in prioridades:
+            c7.selectbox("Soy", personas, key=f"{key}_yo")
+            c7.button("Mis P1 pendientes", key=f"{key}_mis_p1", on_click=_mis_p1)
+    rango = tuple(rango) if isinstance(rango, (list, tuple)) else (rango,)
+    return {"estado": estado, "prioridad": prioridad, "tag": tag, "asignado_a": persona,
+            "desde": rango[0].isoformat() if len(rango) > 0 else None,
+            "hasta": rango[-1].isoformat() if len(rango) > 0 else None,
+            "texto": texto.strip()}
+
 # =========================
 # UI – Header
 # =========================
@@ -179,9 +3110,14 @@ with col_title:
 # Sidebar navegación
 page = st.sidebar.radio(
     "Navegación",
-    ["Inicio", "Notificaciones", "Rondas", "PTW / OT", "Incidentes", "Dashboard", "Documentos", "Config & IoT"],
+    list(PAGE_TABLES),
     index=0
 )
+if APP_TZ_SIN_DEFINIR:
+    st.sidebar.warning("No se pudo determinar la zona horaria del servidor: las fechas se muestran "
+                       "en UTC. Definí APP_TZ (p. ej. APP_TZ=America/Argentina/Buenos_Aires).")
+_t_page = time.perf_counter()
+data = load_page_tables(page)
 
 # =========================
 # Páginas
@@ -191,10 +3127,11 @@ page = st.sidebar.radio(
 if page == "Inicio":
     c1, c2, c3, c4 = st.columns(4)
     # KPIs
-    k_total = len(notifs) if not notifs.empty else 0
-    k_pend = int((notifs["estado"]=="Pendiente").sum()) if not notifs.empty else 0
-    k_rec  = int((notifs["estado"]=="Recibida").sum())  if not notifs.empty else 0
-    k_comp = int((notifs["estado"]=="Completada").sum()) if not notifs.empty else 0
+    counts = kpi_counts("estado")
+    k_total = sum(counts.values())
+    k_pend = counts.get("Pendiente", 0)
+    k_rec  = counts.get("Recibida", 0)
+    k_comp = counts.get("Completada", 0)
 
     c1.metric("Notificaciones totales", k_total)
     c2.metric("Pendientes", k_pend)
@@ -203,16 +3140,15 @@ if page == "Inicio":
 
     st.divider()
     st.markdown("#### Actividad reciente")
-    if not notifs.empty:
-        st.dataframe(
-            notifs.sort_values("ts_creacion", ascending=False).head(10),
-            use_container_width=True
-        )
+    recientes = read_latest(F_NOTIF, 10, "ts_creacion")
+    if not recientes.empty:
+        st.dataframe(fmt_fechas(recientes), use_container_width=True)
     else:
         st.info("Sin notificaciones por ahora.")
 
 # --------- NOTIFICACIONES ---------
 elif page == "Notificaciones":
+    activos, usuarios = data["activos"], data["usuarios"]
     st.markdown("### 📨 Notificaciones operativas")
     with st.expander("➕ Crear nueva notificación", expanded=True):
         col1, col2, col3 = st.columns(3)
@@ -226,100 +3162,93 @@ elif page == "Notificaciones":
             asignado = st.selectbox("Asignar a", usuarios["nombre"].tolist())
 
         if st.button("Crear notificación", use_container_width=True, type="primary"):
-            # reset cache de notifs tras escritura
-            new_id = next_sequential_id(notifs, "id")
             new_row = {
-                "id": new_id, "ts_creacion": now_iso(), "tag": tag,
+                "ts_creacion": now_ms(), "tag": tag,
                 "titulo": titulo, "motivo": motivo, "prioridad": prioridad,
                 "estado": "Pendiente", "asignado_a": asignado,
                 "ts_recibida": "", "ts_cerrada": "", "evidencia": ""
             }
-            notifs = pd.concat([notifs, pd.DataFrame([new_row])], ignore_index=True)
-            save_csv(notifs, F_NOTIF)
-            st.cache_data.clear()  # asegura recarga en esta sesión
+            new_id = insert_rows(F_NOTIF, [new_row])[0]
             st.success(f"Notificación creada (ID {new_id}).")
 
     st.markdown("#### Bandeja")
-    if not notifs.empty:
-        df_show = notifs.copy()
-        df_show["estado"] = df_show["estado"].apply(chip_estado)
-        df_show["prioridad"] = df_show["prioridad"].apply(chip_prioridad)
-        st.dataframe(df_show.sort_values("ts_creacion", ascending=False), use_container_width=True)
-    else:
-        st.info("No hay notificaciones.")
+    filtro = filter_bar("f_notif", ["Pendiente", "Recibida", "Completada"], ["P1", "P2", "P3", "P4"],
+                        activos["tag"].tolist(), usuarios["nombre"].tolist())
+    render_bandeja(F_NOTIF, "ts_creacion", "bandeja_notif", {"estado": chip_estado, "prioridad": chip_prioridad},
+                   "No hay notificaciones.", filtro)
 
     st.markdown("#### Actualizar estado")
-    if not notifs.empty:
+    if table_rows(F_NOTIF):
         col1, col2, col3 = st.columns(3)
         with col1:
-            sel_id = st.number_input("ID de notificación", min_value=1, step=1, value=int(notifs["id"].min()))
+            sel_id = st.number_input("ID de notificación", min_value=1, step=1, value=1)
+            actual = get_row(F_NOTIF, int(sel_id))
+            st.caption(f"{actual['titulo']} • {actual['estado']}" if actual else "ID no encontrado.")
         with col2:
             nuevo_estado = st.selectbox("Nuevo estado", ["Pendiente","Recibida","Completada"])
         with col3:
             evidencia = st.text_input("Evidencia (opcional)", value="")
         if st.button("Aplicar cambio"):
-            mask = notifs["id"] == sel_id
-            if mask.any():
-                notifs.loc[mask, "estado"] = nuevo_estado
-                if nuevo_estado == "Recibida":
-                    notifs.loc[mask, "ts_recibida"] = now_iso()
-                if nuevo_estado == "Completada":
-                    notifs.loc[mask, "ts_cerrada"] = now_iso()
-                if evidencia:
-                    notifs.loc[mask, "evidencia"] = evidencia
-                save_csv(notifs, F_NOTIF)
-                st.cache_data.clear()
+            cambios = {"estado": nuevo_estado}
+            if nuevo_estado == "Recibida":
+                cambios["ts_recibida"] = now_ms()
+            if nuevo_estado == "Completada":
+                cambios["ts_cerrada"] = now_ms()
+            if evidencia:
+                cambios["evidencia"] = evidencia
+            # Se aplica sobre la versión vigente de la tabla, no sobre la copia de esta sesión.
+            if update_row(F_NOTIF, int(sel_id), cambios):
                 st.success("Estado actualizado.")
             else:
                 st.warning("ID no encontrado.")
 
 # --------- RONDAS ---------
 elif page == "Rondas":
+    rondas_plt, usuarios = data["rondas_plt"], data["usuarios"]
     st.markdown("### 🔍 Rondas de inspección")
     if rondas_plt.empty:
         st.info("No hay plantillas de rondas.")
     else:
         plantillas = sorted(rondas_plt["plantilla"].unique())
         sel_pl = st.selectbox("Plantilla", plantillas)
-        subset = rondas_plt[rondas_plt["plantilla"]==sel_pl].copy()
-        operario = st.selectbox("Operario", usuarios["nombre"].tolist())
-
-        st.markdown("#### Lecturas")
-        rows = []
-        for idx, r in subset.reset_index(drop=True).iterrows():
-            col1, col2, col3, col4 = st.columns([2,2,2,2])
-            with col1:
-                st.text_input("Tag", r["tag"], key=f"tag_{idx}", disabled=True)
-            with col2:
-                st.text_input("Variable", r["variable"], key=f"var_{idx}", disabled=True)
-            with col3:
-                valor = st.number_input("Valor", key=f"val_{idx}",
-                                        value=float((r["lim_inf"]+r["lim_sup"])/2))
-            with col4:
-                st.caption(f"Límites: [{r['lim_inf']}, {r['lim_sup']}]")
-            en_rango = (r["lim_inf"] <= valor <= r["lim_sup"])
-            rows.append({
-                "id": next_sequential_id(rondas_run, "id") + idx,
-                "ts": now_iso(), "plantilla": sel_pl, "tag": r["tag"],
-                "variable": r["variable"], "valor": valor,
-                "en_rango": en_rango, "operario": operario
-            })
+        puntos = ronda_plantilla(sel_pl)
 
-        if st.button("Guardar ronda", type="primary"):
-            if rows:
-                rondas_run = pd.concat([rondas_run, pd.DataFrame(rows)], ignore_index=True)
-                save_csv(rondas_run, F_RONDAS_RUN)
-                st.cache_data.clear()
-                st.success("Ronda guardada.")
+        # Las lecturas se editan dentro de un formulario: no hay rerun hasta "Guardar ronda".
+        with st.form(f"ronda_{sel_pl}"):
+            operario = st.selectbox("Operario", usuarios["nombre"].tolist())
+            st.markdown(f"#### Lecturas ({len(puntos)} puntos)")
+            lecturas = st.data_editor(
+                puntos, key=f"lecturas_{sel_pl}", hide_index=True, num_rows="fixed",
+                use_container_width=True, disabled=["tag", "variable", "lim_inf", "lim_sup"],
+                column_config={
+                    "tag": "Tag", "variable": "Variable",
+                    "lim_inf": st.column_config.NumberColumn("Lím. inf."),
+                    "lim_sup": st.column_config.NumberColumn("Lím. sup."),
+                    "valor": st.column_config.NumberColumn("Valor"),
+                })
+            guardar = st.form_submit_button("Guardar ronda", type="primary")
+
+        if guardar:
+            rows, notif_ids = guardar_ronda(sel_pl, operario, lecturas)
+            if rows.empty:
+                st.warning("La ronda no tiene lecturas.")
+            else:
+                fuera = int((~rows["en_rango"]).sum())
+                st.success(f"Ronda guardada ({len(rows)} lecturas, {fuera} fuera de rango).")
+                if notif_ids:
+                    st.warning(f"Se crearon {len(notif_ids)} notificaciones por lecturas fuera de rango "
+                               f"(IDs {', '.join(map(str, notif_ids))}).")
 
         st.markdown("#### Últimas ejecuciones")
-        if not rondas_run.empty:
-            st.dataframe(rondas_run.sort_values("ts", ascending=False).head(20), use_container_width=True)
+        ultimas = latest_rondas_run(20)
+        if not ultimas.empty:
+            st.dataframe(fmt_fechas(ultimas), use_container_width=True)
         else:
             st.info("Aún no hay rondas ejecutadas.")
 
 # --------- PTW / OT ---------
 elif page == "PTW / OT":
+    activos, usuarios = data["activos"], data["usuarios"]
     st.markdown("### 📝 Permisos de trabajo / Órdenes (demo)")
     col1, col2, col3, col4 = st.columns(4)
     with col1:
@@ -330,47 +3259,40 @@ elif page == "PTW / OT":
         area = st.selectbox("Área", activos["area"].unique())
     with col4:
         if st.button("Crear PTW", use_container_width=True, type="primary"):
-            new_id = next_sequential_id(ptwot, "id")
             new_row = {
-                "id": new_id, "ts_solicitud": now_iso(), "tipo": tipo,
+                "ts_solicitud": now_ms(), "tipo": tipo,
                 "solicitante": solicitante, "area": area, "estado": "Borrador",
                 "aprob_hse": "No", "ts_cierre": "", "adjuntos": ""
             }
-            ptwot = pd.concat([ptwot, pd.DataFrame([new_row])], ignore_index=True)
-            save_csv(ptwot, F_PTWOT)
-            st.cache_data.clear()
+            new_id = insert_rows(F_PTWOT, [new_row])[0]
             st.success(f"PTW creado (ID {new_id}).")
 
     st.markdown("#### Bandeja PTW/OT")
-    if not ptwot.empty:
-        st.dataframe(ptwot.sort_values("ts_solicitud", ascending=False), use_container_width=True)
-    else:
-        st.info("Sin PTW/OT registrados.")
+    render_bandeja(F_PTWOT, "ts_solicitud", "bandeja_ptw", {"estado": chip_estado}, "Sin PTW/OT registrados.")
 
     st.markdown("#### Cambiar estado PTW")
-    if not ptwot.empty:
+    if table_rows(F_PTWOT):
         col1, col2, col3 = st.columns(3)
         with col1:
-            idp = st.number_input("ID PTW", min_value=1, step=1, value=int(ptwot["id"].min()))
+            idp = st.number_input("ID PTW", min_value=1, step=1, value=1)
+            actual = get_row(F_PTWOT, int(idp))
+            st.caption(f"{actual['tipo']} • {actual['estado']}" if actual else "ID no encontrado.")
         with col2:
             nuevo = st.selectbox("Estado", ["Borrador","Aprobado","Cerrado"])
         with col3:
             aprob_hse = st.selectbox("Aprobación HSE", ["No","Sí"])
         if st.button("Aplicar"):
-            mask = ptwot["id"] == idp
-            if mask.any():
-                ptwot.loc[mask, "estado"] = nuevo
-                ptwot.loc[mask, "aprob_hse"] = aprob_hse
-                if nuevo == "Cerrado":
-                    ptwot.loc[mask, "ts_cierre"] = now_iso()
-                save_csv(ptwot, F_PTWOT)
-                st.cache_data.clear()
+            cambios = {"estado": nuevo, "aprob_hse": aprob_hse}
+            if nuevo == "Cerrado":
+                cambios["ts_cierre"] = now_ms()
+            if update_row(F_PTWOT, int(idp), cambios):
                 st.success("PTW actualizado.")
             else:
                 st.warning("ID no encontrado.")
 
 # --------- INCIDENTES ---------
 elif page == "Incidentes":
+    activos, usuarios = data["activos"], data["usuarios"]
     st.markdown("### ⚠️ Incidentes / Near Miss (demo)")
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -383,24 +3305,19 @@ elif page == "Incidentes":
         descripcion = st.text_area("Descripción", height=100, value="Descripción breve del hecho.")
 
     if st.button("Reportar incidente", type="primary"):
-        new_id = next_sequential_id(incidentes, "id")
         new_row = {
-            "id": new_id, "ts": now_iso(), "tag": tag, "titulo": titulo,
+            "ts": now_ms(), "tag": tag, "titulo": titulo,
             "severidad": severidad, "descripcion": descripcion,
             "reportado_por": reportado_por, "estado": "Abierto"
         }
-        incidentes = pd.concat([incidentes, pd.DataFrame([new_row])], ignore_index=True)
-        save_csv(incidentes, F_INCIDENTES)
-        st.cache_data.clear()
+        new_id = insert_rows(F_INCIDENTES, [new_row])[0]
         st.success(f"Incidente reportado (ID {new_id}).")
 
     st.markdown("#### Bandeja de incidentes")
-    if not incidentes.empty:
-        df_show = incidentes.copy()
-        df_show["estado"] = df_show["estado"].apply(chip_estado)
-        st.dataframe(df_show.sort_values("ts", ascending=False), use_container_width=True)
-    else:
-        st.info("Sin incidentes registrados.")
+    filtro = filter_bar("f_inc", ["Abierto", "Cerrado"], ["Bajo", "Medio", "Alto", "Crítico"],
+                        activos["tag"].tolist(), usuarios["nombre"].tolist(),
+                        prioridad_label="Severidad", persona_label="Reportado por")
+    render_bandeja(F_INCIDENTES, "ts", "bandeja_inc", {"estado": chip_estado}, "Sin incidentes registrados.", filtro)
 
 # --------- DASHBOARD ---------
 elif page == "Dashboard":
@@ -409,32 +3326,50 @@ elif page == "Dashboard":
 
     with c1:
         st.markdown("#### KPIs")
-        k_total = len(notifs) if not notifs.empty else 0
-        k_p1 = int((notifs["prioridad"]=="P1").sum()) if not notifs.empty else 0
-        k_comp = int((notifs["estado"]=="Completada").sum()) if not notifs.empty else 0
-        k_inc = len(incidentes) if not incidentes.empty else 0
+        por_estado = kpi_counts("estado")
+        k_total = sum(por_estado.values())
+        k_p1 = kpi_counts("prioridad").get("P1", 0)
+        k_comp = por_estado.get("Completada", 0)
+        k_inc = table_rows(F_INCIDENTES)
         st.metric("Notificaciones", k_total)
         st.metric("P1 activas", k_p1)
         st.metric("Completadas", k_comp)
         st.metric("Incidentes", k_inc)
+        cierre = mean_close_time()
+        st.metric("Cierre promedio", f"{cierre.total_seconds() / 3600:.1f} h" if cierre is not None else "–")
 
     with c2:
         st.markdown("#### Distribución por estado")
-        if not notifs.empty:
-            cts = notifs["estado"].value_counts().reset_index()
-            cts.columns = ["estado","cantidad"]
+        if por_estado:
+            cts = pd.DataFrame(sorted(por_estado.items(), key=lambda kv: -kv[1]),
+                               columns=["estado","cantidad"])
             fig = px.bar(cts, x="estado", y="cantidad")
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("Sin datos de notificaciones.")
 
     st.markdown("#### Tendencias de rondas")
-    if not rondas_run.empty:
-        trend = (
-            rondas_run.assign(date=lambda d: pd.to_datetime(d["ts"]).dt.date)
-                      .groupby("date")["en_rango"].mean()
-                      .reset_index()
-        )
+    periodo = st.selectbox("Período", ["Últimos 30 días", "Últimos 90 días", "Último año", "Todo"], index=1)
+    dias = {"Últimos 30 días": 30, "Últimos 90 días": 90, "Último año": 365}.get(periodo)
+    desde = datetime.now() - timedelta(days=dias) if dias else None
+    rollup = rondas_rollup()
+    f1, f2 = st.columns(2)
+    with f1:
+        sel_plt = st.selectbox("Plantilla", ["Todas"] + sorted(rollup["plantilla"].unique()))
+    with f2:
+        sel_tag = st.selectbox("Tag", ["Todos"] + sorted(rollup["tag"].unique()))
+    mask = pd.Series(True, index=rollup.index)
+    if desde is not None:
+        mask &= rollup["fecha"] >= desde.strftime("%Y-%m-%d")
+    if sel_plt != "Todas":
+        mask &= rollup["plantilla"] == sel_plt
+    if sel_tag != "Todos":
+        mask &= rollup["tag"] == sel_tag
+    sel = rollup[mask]
+    if not sel.empty:
+        por_dia = sel.groupby("fecha")[["lecturas", "en_rango"]].sum()
+        trend = pd.DataFrame({"date": pd.to_datetime(por_dia.index).date,
+                              "en_rango": (por_dia["en_rango"] / por_dia["lecturas"]).values})
         fig2 = go.Figure()
         fig2.add_trace(go.Scatter(x=trend["date"], y=trend["en_rango"],
                                   mode="lines+markers", name="% en rango"))
@@ -454,31 +3389,128 @@ elif page == "Documentos":
 
 # --------- CONFIG & IoT ---------
 elif page == "Config & IoT":
-    st.markdown("### ⚙️ Config & IoT (simulador)")
-    st.caption("Regla demo: si P > P_high en V-210 ⇒ crear notificación P1 asignada a Operación Área B")
-    col1, col2, col3 = st.columns(3)
+    usuarios, activos = data["usuarios"], data["activos"]
+    st.markdown("### ⚙️ Config & IoT")
+    svc = iot_service()
+    st.markdown("#### Ingesta IoT")
+    st.caption(f"UDP {IOT_UDP or '—'} • archivo {IOT_TAIL or '—'} • micro-lote {IOT_BATCH_MS:g} ms • "
+               "formato `tag,variable,valor[,ts_ms]` por línea")
+    m1, m2, m3, m4, m5 = st.columns(5)
+    m1.metric("Lecturas", f"{svc.stats['lecturas']:,}")
+    m2.metric("Lecturas/s (último lote)", f"{svc.stats['lecturas/s']:,.0f}")
+    m3.metric("Lotes", svc.stats["lotes"])
+    m4.metric("Notificaciones", svc.stats["notificaciones"])
+    m5.metric("Patrones detectados", svc.stats["correlaciones"])
+    if svc.stats["error"]:
+        st.warning(svc.stats["error"])
+
+    st.markdown("#### Reglas")
+    st.caption("Una notificación por regla disparada; sin responsable se asigna al área.")
+    reglas = data["reglas"].reindex(columns=REGLAS_COLUMNS)
+    with st.form("form_reglas"):
+        editadas = st.data_editor(
+            reglas.astype({c: object for c in ("tag", "variable", "operador", "comparador", "prioridad",
+                                               "asignado_a", "area")}),
+            key="reglas_editor", num_rows="dynamic", hide_index=True, use_container_width=True,
+            disabled=["id"],
+            column_config={
+                "tag": st.column_config.SelectboxColumn("Tag", options=activos["tag"].astype(str).tolist(), required=True),
+                "variable": st.column_config.TextColumn("Variable", required=True),
+                "operador": st.column_config.TextColumn(
+                    "Operador", help="Vacío = lectura cruda. media:300, tasa:60 (por minuto), min:600, max:600, "
+                                     "banda:0.5; se encadenan con |, p. ej. banda:0.1|tasa:60"),
+                "comparador": st.column_config.SelectboxColumn("Comparador", options=REGLA_COMPARADORES, default=">"),
+                "limite": st.column_config.NumberColumn("Límite", required=True),
+                "prioridad": st.column_config.SelectboxColumn("Prioridad", options=["P1", "P2", "P3", "P4"], default="P2"),
+                "asignado_a": st.column_config.SelectboxColumn("Asignado a", options=[""] + usuarios["nombre"].tolist()),
+                "area": st.column_config.SelectboxColumn("Área", options=sorted(activos["area"].astype(str).unique())),
+                "activa": st.column_config.CheckboxColumn("Activa", default=True),
+                "banda_muerta": st.column_config.NumberColumn("Banda muerta", min_value=0.0, default=0.0),
+                "retardo_on_s": st.column_config.NumberColumn("Retardo on [s]", min_value=0.0, default=0.0),
+                "retardo_off_s": st.column_config.NumberColumn("Retardo off [s]", min_value=0.0, default=0.0),
+            })
+        if st.form_submit_button("Guardar reglas"):
+            try:
+                guardar_reglas(editadas)
+                st.success("Reglas guardadas.")
+            except ValueError as e:
+                st.error(str(e))
+
+    st.markdown("#### Alarmas")
+    st.caption("Una alarma por regla: mientras su notificación siga abierta se actualiza en el lugar.")
+    alarmas = svc.alarmas_df()
+    if not alarmas.empty:
+        st.dataframe(fmt_fechas(alarmas), hide_index=True, use_container_width=True)
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        regla_sup = st.selectbox("Regla", reglas["id"].tolist(),
+                                 format_func=lambda i: f"{i} • {reglas.loc[reglas['id'] == i, 'tag'].iloc[0]}")
+    with col2:
+        minutos_sup = st.number_input("Minutos", min_value=1, value=60, step=15)
+    with col3:
+        if st.button("Suprimir", use_container_width=True) and regla_sup is not None:
+            svc.suprimir(regla_sup, minutos_sup)
+            st.rerun()
+    with col4:
+        if st.button("Quitar supresión", use_container_width=True) and regla_sup is not None:
+            svc.reactivar(regla_sup)
+            st.rerun()
+
+    st.markdown("#### Patrones (CEP)")
+    st.caption("Secuencias de activaciones de reglas dentro de una ventana; cada coincidencia genera una "
+               "notificación correlacionada.")
+    patrones = data["patrones"].reindex(columns=PATRONES_COLUMNS)
+    with st.form("form_patrones"):
+        editados = st.data_editor(
+            patrones.astype({c: object for c in ("nombre", "pasos", "prioridad", "asignado_a", "area")}),
+            key="patrones_editor", num_rows="dynamic", hide_index=True, use_container_width=True,
+            disabled=["id"],
+            column_config={
+                "nombre": st.column_config.TextColumn("Nombre"),
+                "pasos": st.column_config.TextColumn(
+                    "Pasos", required=True, help="Ids de regla en orden, separados por ->; alternativas con |, "
+                                                 "p. ej. 2 -> 3 o 2|5 -> 3"),
+                "ventana_s": st.column_config.NumberColumn("Ventana [s]", min_value=1.0, default=600.0, required=True),
+                "prioridad": st.column_config.SelectboxColumn("Prioridad", options=["P1", "P2", "P3", "P4"], default="P1"),
+                "asignado_a": st.column_config.SelectboxColumn("Asignado a", options=[""] + usuarios["nombre"].tolist()),
+                "area": st.column_config.SelectboxColumn("Área", options=sorted(activos["area"].astype(str).unique())),
+                "activa": st.column_config.CheckboxColumn("Activa", default=True),
+            })
+        if st.form_submit_button("Guardar patrones"):
+            try:
+                guardar_patrones(editados)
+                st.success("Patrones guardados.")
+            except ValueError as e:
+                st.error(str(e))
+    estado_patrones = svc.patrones_df()
+    if not estado_patrones.empty:
+        st.dataframe(fmt_fechas(estado_patrones), hide_index=True, use_container_width=True)
+
+    st.markdown("#### Lectura de prueba")
+    col1, col2, col3, col4 = st.columns(4)
     with col1:
-        p_actual = st.slider("Presión V-210 [bar]", 0.0, 50.0, 4.5, step=0.5)
+        tag_prueba = st.selectbox("Tag", activos["tag"].astype(str).tolist())
     with col2:
-        p_high = st.number_input("Umbral P_high [bar]", value=8.0, step=0.5)
+        variable_prueba = st.text_input("Variable", value="Presión")
     with col3:
+        valor_prueba = st.slider("Valor", 0.0, 100.0, 4.5, step=0.5)
+    with col4:
         crear = st.button("Evaluar evento", type="primary")
 
     if crear:
-        if p_actual > p_high:
-            new_id = next_sequential_id(notifs, "id")
-            new_row = {
-                "id": new_id, "ts_creacion": now_iso(), "tag": "V-210",
-                "titulo": "Alarma presión alta V-210", "motivo": f"P={p_actual} > {p_high}",
-                "prioridad": "P1", "estado": "Pendiente", "asignado_a": "Operario 1",
-                "ts_recibida": "", "ts_cerrada": "", "evidencia": "Evento IoT simulado"
-            }
-            notifs = pd.concat([notifs, pd.DataFrame([new_row])], ignore_index=True)
-            save_csv(notifs, F_NOTIF)
-            st.cache_data.clear()
-            st.success(f"Notificación P1 creada por evento IoT (ID {new_id}).")
+        # La lectura manual pasa por el mismo camino que un lote recibido.
+        ids, cumplidas = svc.process(f"{tag_prueba},{variable_prueba},{valor_prueba}\n".encode(), detalle=True)
+        if ids:
+            st.success(f"Notificación creada por evento IoT (ID {', '.join(map(str, ids))}).")
+        elif cumplidas:
+            st.info("La alarma ya está activa, suprimida o esperando su retardo: no se crea otra notificación.")
         else:
-            st.info("No se dispara evento (P dentro de umbral).")
+            st.info("Ninguna regla se dispara con esa lectura.")
+
+    ultimas = svc.ultimas_df()
+    if not ultimas.empty:
+        st.caption(f"Últimas lecturas ({len(ultimas)} tag/variable)")
+        st.dataframe(fmt_fechas(ultimas.head(200)), hide_index=True, use_container_width=True)
 
     st.divider()
     st.markdown("#### Gestión simple de usuarios (demo)")
@@ -489,12 +3521,41 @@ elif page == "Config & IoT":
         submitted = st.form_submit_button("Agregar")
         if submitted and nombre.strip():
             new_row = {"user_id": f"u{len(usuarios)+1}", "nombre": nombre, "rol": rol, "area": area}
-            usuarios = pd.concat([usuarios, pd.DataFrame([new_row])], ignore_index=True)
-            save_csv(usuarios, F_USUARIOS)
-            st.cache_data.clear()
+            insert_rows(F_USUARIOS, [new_row])
+            usuarios = load_csv(F_USUARIOS)
             st.success("Usuario agregado.")
 
     st.dataframe(usuarios, use_container_width=True)
 
 # ======= Footer mini-diagnóstico =======
+record_page_timing(page, (time.perf_counter() - _t_page) * 1000)
+with st.sidebar.expander("Diagnóstico", expanded=False):
+    st.caption("Latencia de render por página" + (" (carga completa)" if EAGER_LOAD else ""))
+    st.dataframe(page_timing_stats(), hide_index=True, use_container_width=True)
+    st.caption("Cache de tablas")
+    st.dataframe(cache_stats(), hide_index=True, use_container_width=True)
+    w = write_coordinator().stats
+    st.caption(f"Escritor: {w['mutaciones']} mutaciones en {w['commits']} commits")
+    for tabla, error in list(_journal_state()["errores"].items()):
+        st.warning(f"Compactación del journal de {tabla} fallida: {error}")
+    if st.button("Verificar agregados"):
+        diff_kpi = check_kpis(fix=True)
+        diff_rollup = check_rondas_rollup(fix=True)
+        if diff_kpi.empty and diff_rollup.empty:
+            st.success("KPIs y rollup de rondas consistentes.")
+        else:
+            st.warning("Se corrigieron diferencias:")
+            for diff in (diff_kpi, diff_rollup):
+                if not diff.empty:
+                    st.dataframe(diff, hide_index=True, use_container_width=True)
+    if st.button("Benchmark ingesta IoT"):
+        st.dataframe(bench_iot_ingest(), hide_index=True, use_container_width=True)
+    if st.button("Benchmark patrones CEP"):
+        st.dataframe(bench_cep(), hide_index=True, use_container_width=True)
+    if st.button("Benchmark IDs (1M filas)"):
+        st.dataframe(bench_id_allocator(), hide_index=True, use_container_width=True)
+    if st.button("Memoria por tabla"):
+        st.dataframe(memory_report(), hide_index=True, use_container_width=True)
+    if st.button("Benchmark índices secundarios"):
+        st.dataframe(bench_secondary_index(), hide_index=True, use_container_width=True)
 st.sidebar.caption(f"Build session: {datetime.now():%Y-%m-%d %H:%M}")